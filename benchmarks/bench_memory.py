@@ -0,0 +1,88 @@
+"""
+Memory used by each additional conversation with the same character card.
+
+Compares the previous layout (fresh dicts holding copies of the preset blocks,
+plus a per-conversation buffer with their JSON encoding) with shared Message objects,
+whose per-conversation cost does not depend on the size of the card.
+
+    python -m benchmarks.bench_memory
+"""
+
+import pathlib
+import tempfile
+import tracemalloc
+
+from rp4.client import ChatGPTClient, Preset
+from rp4.history import Message
+from rp4.payload import encode_json
+from rp4.templates import render_template
+
+SESSIONS = 200
+FIELDS = {"model": "gpt-4", "max_tokens": 1000, "temperature": 0.9, "stream": True}
+SENTENCE = "{{char}} is a knight of the northern order who has sworn to protect {{user}}. "
+
+
+def make_preset(card_kib: int) -> Preset:
+    card = SENTENCE * (card_kib * 1024 // len(SENTENCE))
+    return Preset(
+        system_prompt1="You are {{char}}. Stay in character.",
+        character_description=card,
+        example_chat=card[: len(card) // 4],
+        world_lore=card[: len(card) // 2],
+        first_ai_message="Halt, {{user}}!",
+    )
+
+
+def legacy_session(client: ChatGPTClient, preset_name: str):
+    preset = client.presets[preset_name]
+
+    def render(text: str) -> str:
+        return render_template(text, preset_name, client.globals.user_name)
+
+    history = [
+        {"role": "system", "content": render(preset.system_prompt1)},
+        {"role": "system", "content": "AI CHARACTER DESCRIPTION:\n" + render(preset.character_description)},
+        {"role": "system", "content": "EXAMPLE CHAT WITH THIS CHARACTER:\n" + render(preset.example_chat)},
+        {"role": "system", "content": "WORLD LORE:\n" + render(preset.world_lore)},
+        {"role": "assistant", "content": render(preset.first_ai_message)},
+        {"role": "user", "content": "Hello there."},
+    ]
+    encoded = bytearray(b",".join(encode_json(message) for message in history))
+    return history, encoded
+
+
+def shared_session(client: ChatGPTClient, preset_name: str):
+    conversation = client.new_conversation()
+    conversation.construct_initial_chat_history(preset_name)
+    conversation.chat_history.append(Message("user", "Hello there."))
+    conversation.payload_encoder.encode_body(FIELDS, conversation.chat_history)
+    return conversation
+
+
+def per_session_bytes(make_session) -> float:
+    sessions = [make_session()]  # the first one creates what later sessions share
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions.extend(make_session() for _ in range(SESSIONS))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / SESSIONS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as config_dir:
+        client = ChatGPTClient(
+            globals_file_path=pathlib.Path(config_dir) / "global_settings.json",
+            presets_file_path=pathlib.Path(config_dir) / "preset_settings.json",
+        )
+        print(f"{'card KiB':>9} {'dicts KiB/session':>18} {'shared KiB/session':>19}")
+        for card_kib in (4, 16, 64, 256):
+            preset_name = f"Knight {card_kib}"
+            client.presets[preset_name] = make_preset(card_kib)
+            legacy = per_session_bytes(lambda: legacy_session(client, preset_name)) / 1024
+            shared = per_session_bytes(lambda: shared_session(client, preset_name)) / 1024
+            print(f"{card_kib:>9} {legacy:>18.1f} {shared:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-turn cost of building the /chat/completions request body.
+
+Compares re-serializing the whole history every turn (what `requests.post(json=...)` does)
+with MessagesEncoder, which only encodes the messages added since the previous turn.
+Serializing does not grow with the history, but the body is still one bytes object joined from the
+cached pieces every turn. That copy is O(body size) and is shown in its own column: a plain memory copy,
+well under 0.1 ms per 500 KiB, which the socket then has to copy again anyway.
+
+    python -m benchmarks.bench_payload
+"""
+
+import json
+import time
+
+from rp4.payload import MessagesEncoder, encode_json
+
+CARD = "She is a knight of the northern order. " * 400  # ~16 KB character card
+REPLY = "The wind howls over the ramparts as she turns to you. " * 20
+FIELDS = {"model": "gpt-4", "max_tokens": 1000, "temperature": 0.9, "stream": True}
+REPEAT = 20
+
+
+def make_turns(count: int):
+    history = [{"role": "system", "content": CARD}, {"role": "system", "content": CARD}]
+    for idx in range(count):
+        history.append({"role": "user", "content": f"Turn {idx}: what do you see?"})
+        history.append({"role": "assistant", "content": REPLY})
+    return history
+
+
+def full_encode(history) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        json.dumps({**FIELDS, "messages": history}).encode("utf-8")
+    return (time.perf_counter() - start) / REPEAT
+
+
+def incremental_encode(history) -> float:
+    encoder = MessagesEncoder()
+    encoder.encode_body(FIELDS, history[:-2])
+    elapsed = 0.0
+    for _ in range(REPEAT):
+        # a new turn: the cached prefix is reused and only the last two messages are encoded.
+        turn = [*history[:-2], dict(history[-2]), dict(history[-1])]
+        start = time.perf_counter()
+        encoder.encode_body(FIELDS, turn)
+        elapsed += time.perf_counter() - start
+    return elapsed / REPEAT
+
+
+def join_only(history) -> float:
+    # the part of incremental_encode that still depends on the size of the history.
+    pieces = [encode_json(message) for message in history]
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        b",".join(pieces)
+    return (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    print(f"{'turns':>6} {'body KiB':>9} {'full ms':>9} {'incremental ms':>15} {'of which copy ms':>17}")
+    for turns in (10, 50, 100, 200, 400):
+        history = make_turns(turns)
+        size = len(MessagesEncoder().encode_body(FIELDS, history)) / 1024
+        print(
+            f"{turns:>6} {size:>9.0f} {full_encode(history) * 1e3:>9.3f} "
+            f"{incremental_encode(history) * 1e3:>15.3f} {join_only(history) * 1e3:>17.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Cost of expanding macros in preset fields.
+
+Compares substituting with a regex on every render (what a straightforward implementation does
+each turn) with compiled templates: static cards come from the template's cache,
+cards with random or time macros only join their precompiled parts.
+
+    python -m benchmarks.bench_templates
+"""
+
+import datetime
+import random
+import re
+import time
+
+from rp4.templates import MacroContext, compile_template
+
+PARAGRAPH = "{{char}} is a knight of the northern order who has sworn to protect {{user}} on the road. "
+DYNAMIC_PARAGRAPH = "It is {{time}} and {{char}} looks {{random:tired,alert,amused}} at {{user}}. "
+CONTEXT = MacroContext("Astrid", "Traveler")
+RENDERS = 5000
+MACRO = re.compile(r"\{\{\s*(\w+)\s*(?::(.*?))?\}\}", re.DOTALL | re.IGNORECASE)
+
+
+def substitute(source: str, context: MacroContext) -> str:
+    def replace(match: re.Match) -> str:
+        match match[1].lower(), match[2]:
+            case "char", None:
+                return context.char
+            case "user", None:
+                return context.user
+            case "time", None:
+                return f"{datetime.datetime.now():%I:%M %p}".lstrip("0")
+            case "random", str(args):
+                return random.choice(args.split(","))
+        return match[0]
+
+    return MACRO.sub(replace, source)
+
+
+def measure(render) -> float:
+    start = time.perf_counter()
+    for _ in range(RENDERS):
+        render()
+    return (time.perf_counter() - start) / RENDERS
+
+
+def main():
+    print(f"{'card':>8} {'KiB':>5} {'compile ms':>11} {'regex us':>9} {'compiled us':>12}")
+    for paragraphs in (50, 200, 800):
+        for name, paragraph in (("static", PARAGRAPH), ("dynamic", DYNAMIC_PARAGRAPH)):
+            card = paragraph * paragraphs
+            compile_template.cache_clear()
+            start = time.perf_counter()
+            compile_template(card)
+            compile_ms = (time.perf_counter() - start) * 1e3
+            regex_us = measure(lambda: substitute(card, CONTEXT)) * 1e6
+            compiled_us = measure(lambda: compile_template(card).render(CONTEXT)) * 1e6
+            print(f"{name:>8} {len(card) / 1024:>5.0f} {compile_ms:>11.3f} {regex_us:>9.1f} {compiled_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
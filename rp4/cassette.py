@@ -0,0 +1,231 @@
+import base64
+import collections
+import gzip
+import itertools
+import json
+import pathlib
+import threading
+import time
+import typing
+import urllib.parse
+
+import requests
+import requests.adapters
+import urllib3.exceptions
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+REDACTED = "REDACTED"
+SECRET_HEADERS = frozenset(("authorization", "proxy-authorization", "x-api-key", "api-key", "cookie", "set-cookie"))
+SECRET_QUERY_PARAMS = frozenset(("key", "api_key", "apikey", "token", "access_token"))
+# the recorded body is already decoded, so these would describe the wrong bytes on replay.
+TRANSPORT_HEADERS = frozenset(("content-encoding", "transfer-encoding", "content-length"))
+
+
+class CassetteError(requests.RequestException):
+    pass
+
+
+def redact_url(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    query = [
+        (name, REDACTED if name.lower() in SECRET_QUERY_PARAMS else value)
+        for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def redact_headers(headers: typing.Mapping[str, str]) -> dict[str, str]:
+    return {name: (REDACTED if name.lower() in SECRET_HEADERS else value) for name, value in headers.items()}
+
+
+def describe_request(request: requests.PreparedRequest) -> dict:
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if request.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    try:
+        body = json.loads(body) if body else None
+    except ValueError:
+        body = base64.b64encode(body).decode("ascii")
+    return {
+        "method": request.method,
+        "url": redact_url(request.url),
+        "headers": redact_headers(request.headers),
+        "body": body,
+    }
+
+
+def endpoint_key(method: str, url: str) -> tuple[str, str]:
+    # tunnel hosts and proxy prefixes change from day to day, so only the endpoint name identifies a request.
+    return method.upper(), urllib.parse.urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class RecordingRaw:
+    """
+    Wraps a urllib3 response and keeps every chunk the client reads together with the delay before it.
+    """
+
+    def __init__(self, raw, cassette: dict, on_done, started: float):
+        self._raw = raw
+        self._cassette = cassette
+        self._on_done = on_done
+        self._last = started
+        self._done = False
+
+    def _record(self, chunk: bytes):
+        now = time.perf_counter()
+        if chunk:
+            self._cassette["response"]["chunks"].append(
+                [round(now - self._last, 6), base64.b64encode(chunk).decode("ascii")]
+            )
+        self._last = now
+
+    def _finish(self, error: Exception | None = None):
+        if not self._done:
+            self._done = True
+            self._cassette["response"]["error"] = repr(error) if error else None
+            self._on_done(self._cassette)
+
+    def stream(self, amt=2**16, decode_content=None):
+        try:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                self._record(chunk)
+                yield chunk
+        except Exception as ex:
+            self._finish(ex)
+            raise
+        self._finish()
+
+    def read(self, *args, **kwargs):
+        try:
+            chunk = self._raw.read(*args, **kwargs)
+        except Exception as ex:
+            self._finish(ex)
+            raise
+        self._record(chunk)
+        if not chunk:
+            self._finish()
+        return chunk
+
+    def close(self):
+        self._finish()
+        self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Sends requests as usual and saves each exchange to a numbered JSON cassette in cassette_dir.
+    Secrets in headers and query strings are redacted, the response is stored as the decoded byte stream.
+    """
+
+    def __init__(self, cassette_dir: pathlib.Path, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette_dir = cassette_dir
+        self.cassette_dir.mkdir(parents=True, exist_ok=True)
+        self._counter = itertools.count(len(list(self.cassette_dir.glob("*.json"))) + 1)
+        self._lock = threading.Lock()
+
+    def save(self, cassette: dict):
+        with self._lock:
+            number = next(self._counter)
+        method, endpoint = endpoint_key(cassette["request"]["method"], cassette["request"]["url"])
+        file_path = self.cassette_dir / f"{number:04d}-{method}-{endpoint or 'root'}.json"
+        with open(file_path, "w", encoding="utf-8") as of:
+            json.dump(cassette, of, indent=1, ensure_ascii=False)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        cassette = {"request": describe_request(request), "response": None}
+        started = time.perf_counter()
+        try:
+            response = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        except requests.RequestException as ex:
+            cassette["error"] = repr(ex)
+            self.save(cassette)
+            raise
+        cassette["response"] = {
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": redact_headers(
+                {name: value for name, value in response.headers.items() if name.lower() not in TRANSPORT_HEADERS}
+            ),
+            "chunks": [],
+        }
+        response.raw = RecordingRaw(response.raw, cassette, self.save, started)
+        return response
+
+
+class ReplayRaw:
+    """
+    Plays back recorded chunks, sleeping for the recorded delays divided by speed (0 means no delays).
+    """
+
+    def __init__(self, response: dict, speed: float):
+        self._response = response
+        self._speed = speed
+        self.closed = False
+
+    def stream(self, amt=2**16, decode_content=None):
+        for delay, data in self._response["chunks"]:
+            if self._speed > 0:
+                time.sleep(delay / self._speed)
+            yield base64.b64decode(data)
+        if self._response.get("error"):
+            raise urllib3.exceptions.ProtocolError(f"Recorded stream broke: {self._response['error']}")
+
+    def read(self, *args, **kwargs):
+        return b"".join(self.stream())
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """
+    Serves cassettes saved by RecordingAdapter instead of touching the network.
+    Requests are matched by method and endpoint, each endpoint's cassettes are played in order and then repeated.
+    """
+
+    def __init__(self, cassette_dir: pathlib.Path, speed: float = 1.0):
+        super().__init__()
+        self.speed = speed
+        self.cassettes: dict[tuple[str, str], collections.deque] = collections.defaultdict(collections.deque)
+        for file_path in sorted(cassette_dir.glob("*.json")):
+            with open(file_path, encoding="utf-8") as f:
+                cassette = json.load(f)
+            self.cassettes[endpoint_key(cassette["request"]["method"], cassette["request"]["url"])].append(cassette)
+        self._lock = threading.Lock()
+
+    def next_cassette(self, request: requests.PreparedRequest) -> dict:
+        with self._lock:
+            if not (queue := self.cassettes.get(endpoint_key(request.method, request.url))):
+                raise CassetteError(f"No recorded response for {request.method} {request.url}", request=request)
+            cassette = queue[0]
+            queue.rotate(-1)
+            return cassette
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        cassette = self.next_cassette(request)
+        if cassette.get("error") or not cassette.get("response"):
+            raise requests.ConnectionError(f"Recorded failure: {cassette.get('error')}", request=request)
+        recorded = cassette["response"]
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = ReplayRaw(recorded, self.speed)
+        return response
+
+    def close(self):
+        pass
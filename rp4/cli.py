@@ -1,8 +1,40 @@
 import argparse
+import dataclasses
+import datetime
+import functools
+import pathlib
+import typing
+from pprint import pprint
 
-from rp4.client import ChatGPTClient
+from rp4 import daemon
+from rp4.consts import PROGRAM_NAME
 from rp4.desktop_shortcut import setup_shortcut
-from rp4.gui import show_window
+
+
+def print_reply(send_message: typing.Callable[..., str]):
+    streamed = []
+
+    def print_chunk(chunk: str):
+        streamed.append(chunk)
+        print(chunk, end="", flush=True)
+
+    reply = send_message(on_chunk=print_chunk)
+    print("" if streamed else reply)
+
+
+def print_search_hits(client, args: argparse.Namespace):
+    def day_start(day: datetime.date | None) -> datetime.datetime | None:
+        return day and datetime.datetime.combine(day, datetime.time())
+
+    hits = client.transcripts.search(
+        args.search_query,
+        preset=args.set_preset,
+        model=args.model_name,
+        since=day_start(args.search_since),
+        until=day_start(args.search_until and args.search_until + datetime.timedelta(days=1)),
+    )
+    for hit in hits:
+        print(f"{hit.created:%Y-%m-%d %H:%M}  {hit.preset} ({hit.model})  {hit.role}: {hit.snippet}")
 
 
 def main():
@@ -41,12 +73,38 @@ def main():
         action="store_true",
         help="Launch GUI.",
     )
+    parser.add_argument(
+        "--profile",
+        dest="profile_dir",
+        nargs="?",
+        type=pathlib.Path,
+        const=pathlib.Path.home() / ".config" / PROGRAM_NAME / "profiles",
+        help="Profile GUI rendering and write a summary and a cProfile dump to DIR on exit.",
+    )
     parser.add_argument(
         "--ask",
         dest="ask_question",
         type=str,
         help="Ask model a question.",
     )
+    parser.add_argument(
+        "--search",
+        dest="search_query",
+        type=str,
+        help="Search saved conversations. Combine with --preset, --model, --since and --until to filter.",
+    )
+    parser.add_argument(
+        "--since",
+        dest="search_since",
+        type=datetime.date.fromisoformat,
+        help="Only find messages from this day on (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "--until",
+        dest="search_until",
+        type=datetime.date.fromisoformat,
+        help="Only find messages up to and including this day (YYYY-MM-DD).",
+    )
     parser.add_argument(
         "--preset",
         dest="set_preset",
@@ -65,11 +123,77 @@ def main():
         action="store_true",
         help="Create desktop shortcut.",
     )
+    parser.add_argument(
+        "--record",
+        dest="record_dir",
+        type=pathlib.Path,
+        help="Save every request and the streamed response with its timings to cassettes in DIR.",
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay_dir",
+        type=pathlib.Path,
+        help="Serve cassettes recorded with --record from DIR instead of contacting the server.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        dest="replay_speed",
+        type=float,
+        default=1.0,
+        help="Replay speed: 1 is the recorded speed, 2 twice as fast, 0 as fast as possible.",
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="use_daemon",
+        action="store_true",
+        help="Forward --ask to a background process that is started on first use and exits when idle.",
+    )
+    parser.add_argument(
+        "--session",
+        dest="session_name",
+        type=str,
+        help="Continue a named conversation kept by the daemon (implies --daemon).",
+    )
+    parser.add_argument(
+        "--stop-daemon",
+        dest="stop_daemon",
+        action="store_true",
+        help="Stop the background process.",
+    )
+    parser.add_argument(
+        "--serve-daemon",
+        dest="serve_daemon",
+        action="store_true",
+        help=argparse.SUPPRESS,
+    )
 
     args = parser.parse_args()
 
+    # handled before the client is imported, forwarding to the daemon must not pay for the backends.
+    match args:
+        case argparse.Namespace(serve_daemon=True):
+            return daemon.serve()
+        case argparse.Namespace(stop_daemon=True):
+            return daemon.stop()
+        case argparse.Namespace() if args.ask_question and (args.use_daemon or args.session_name):
+            return print_reply(
+                functools.partial(
+                    daemon.ask,
+                    args.ask_question,
+                    args.set_preset,
+                    args.model_name,
+                    args.session_name,
+                )
+            )
+
+    from rp4.client import ChatGPTClient
+
     client = ChatGPTClient()
     client.globals.verbose = bool(args.be_verbose)
+    if args.record_dir:
+        client.record_traffic(args.record_dir)
+    if args.replay_dir:
+        client.replay_traffic(args.replay_dir, args.replay_speed)
     match args:
         case argparse.Namespace(create_shortcut=True):
             return setup_shortcut()
@@ -79,16 +203,24 @@ def main():
             return print("\n".join(client.globals.model_names))
         case argparse.Namespace(print_presets=True):
             return print("\n".join(client.presets))
+        case argparse.Namespace() if args.search_query:
+            return print_search_hits(client, args)
         case argparse.Namespace() if args.ask_question:
-            return print(
-                client.send_message(
+            print_reply(
+                functools.partial(
+                    client.send_message,
                     args.ask_question,
                     (args.set_preset or client.globals.selected_preset),
                     args.model_name,
                 )
             )
+            if client.globals.verbose:
+                pprint(dataclasses.asdict(client.stats))
+            return
         case argparse.Namespace(launch_gui=True):
-            return show_window(client)
+            from rp4.gui import show_window
+
+            return show_window(client, args.profile_dir)
         case _:
             return parser.print_help()
 
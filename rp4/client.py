@@ -1,14 +1,31 @@
+import contextlib
+import copy
 import dataclasses
+import functools
 import json
 import pathlib
 import shutil
+import sqlite3
+import threading
+import time
 import typing
+import uuid
+import weakref
 from pprint import pprint
 
-import g4f
 import requests
 
-PROGRAM_NAME = "rp4"
+from rp4.cassette import RecordingAdapter, ReplayAdapter
+from rp4.config import JsonFile
+from rp4.consts import PROGRAM_NAME
+from rp4.history import ChatHistory, ChatHistoryEntry, Message, shared_message
+from rp4.payload import MessagesEncoder, maybe_compress
+from rp4.providers import ProviderScoreboard, race_providers, stream_g4f
+from rp4.search import TranscriptIndex
+from rp4.slots import RequestSlots
+from rp4.swipes import Swipes
+from rp4.templates import MacroContext, compile_template
+from rp4.warmup import ConnectionWarmer
 
 
 @dataclasses.dataclass
@@ -25,6 +42,21 @@ class GlobalSettings:
     md2html: bool = True
     max_tokens: int = 1000
     temperature: float = 0.9
+    resume_truncated: bool = False
+    max_resume_attempts: int = 2
+    gzip_requests: bool = False
+    g4f_providers: list[str] = dataclasses.field(default_factory=list)
+    g4f_race: bool = False
+    g4f_race_width: int = 3
+    warmup: bool = True
+    warmup_keepalive_sec: int = 45
+    warmup_idle_sec: int = 600
+    daemon_idle_sec: int = 900
+    max_concurrent_requests: int = 3
+    index_transcripts: bool = True
+    swipes: int = 1
+    prefetch_swipe: bool = False
+    user_name: str = "User"
 
 
 @dataclasses.dataclass
@@ -38,21 +70,40 @@ class Preset:
     world_lore: str = ""
 
 
-class ChatHistoryEntry(typing.TypedDict):
-    role: str
-    content: str
+@dataclasses.dataclass
+class ClientStats:
+    resumed_streams: int = 0
+    saved_chunks: int = 0  # streamed chunks that were kept instead of regenerated
+    warmups: int = 0
+    warmup_failures: int = 0
+    last_warmup_ms: float | None = None
+    first_ttft_ms: float | None = None
+    last_ttft_ms: float | None = None
+
+
+class StreamResult(typing.NamedTuple):
+    text: str
+    chunks: int
+    finished: bool
+    extra: tuple[str, ...] = ()  # the other choices when more than one was requested
 
 
 class FetchError(requests.RequestException):
     pass
 
 
+class RequestCancelled(requests.RequestException):
+    pass
+
+
 class ChatGPTClient:
     def __init__(self, globals_file_path: str | None = None, presets_file_path: str | None = None, **kwargs):
         # create a config folder and copy default config files
         self.globals_file_path = globals_file_path
         self.presets_file_path = presets_file_path
         self.deploy_default_configs()
+        self.globals_file = JsonFile(self.globals_file_path)
+        self.presets_file = JsonFile(self.presets_file_path)
         # global settings
         self.globals = GlobalSettings()
         self.set_kwargs(kwargs)
@@ -61,7 +112,79 @@ class ChatGPTClient:
         self.presets = {"Assistant": Preset()}
         self.load_presets()
         # history
-        self.chat_history: list[ChatHistoryEntry] = []
+        self.chat_history = ChatHistory()
+        self.conversation_id = uuid.uuid4().hex
+        self._greeting: tuple[tuple[str, str], Message] | None = None
+        self.payload_encoder = MessagesEncoder()
+        self.swipes = Swipes()
+        self.stats = ClientStats()
+        self.transcripts = TranscriptIndex(self.globals_file_path.parent / "transcripts.sqlite3")
+        self.provider_scoreboard = ProviderScoreboard(self.globals_file_path.parent / "provider_stats.json")
+        # connections, shared by all conversations
+        self.session = requests.Session()
+        self.warmer = ConnectionWarmer(self)
+        self.request_slots = RequestSlots(self.globals.max_concurrent_requests)
+        self.n_supported: dict[str, bool] = {}  # base_url -> whether the endpoint returns several choices
+        self.conversations: weakref.WeakSet[ChatGPTClient] = weakref.WeakSet()
+        self.cancelled = threading.Event()
+        self.responses: set[requests.Response] = set()  # streams of this conversation that are being read
+
+    def new_conversation(self) -> "ChatGPTClient":
+        """
+        Create a client with its own history and settings that shares presets, connections and stats with this one.
+        """
+        conversation = copy.copy(self)
+        conversation.globals = dataclasses.replace(self.globals)
+        conversation.chat_history = ChatHistory()
+        conversation.conversation_id = uuid.uuid4().hex
+        conversation._greeting = None
+        conversation.payload_encoder = MessagesEncoder()
+        conversation.swipes = Swipes()
+        conversation.cancelled = threading.Event()
+        conversation.responses = set()
+        self.conversations.add(conversation)
+        return conversation
+
+    def cancel(self):
+        """
+        Stop the requests of this conversation, including background fetches and those waiting for a request slot.
+        Each one gives up at its next chunk, closes its response and releases its slot.
+        A cancelled conversation stays cancelled, continue in a new_conversation().
+        """
+        self.cancelled.set()
+        for response in list(self.responses):
+            # wakes a read that waits for the server, the reading thread then closes the response itself.
+            # urllib3 before 2.3 has no shutdown(), there the request only stops at its next chunk.
+            with contextlib.suppress(AttributeError, ValueError, RuntimeError, OSError):
+                response.raw.shutdown()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise RequestCancelled("The request was cancelled.")
+
+    @contextlib.contextmanager
+    def request_slot(self, background: bool = False):
+        # all conversations share the connection pool, so they also share the request limit.
+        with self.request_slots.acquire(background):
+            self.check_cancelled()
+            yield
+
+    def record_traffic(self, cassette_dir: pathlib.Path):
+        """
+        Save every HTTP exchange, with keys redacted and chunk timings preserved, as cassettes in cassette_dir.
+        """
+        adapter = RecordingAdapter(cassette_dir)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def replay_traffic(self, cassette_dir: pathlib.Path, speed: float = 1.0):
+        """
+        Serve recorded cassettes instead of the network. speed scales the recorded delays, 0 disables them.
+        """
+        adapter = ReplayAdapter(cassette_dir, speed)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.globals.warmup = False
 
     def deploy_default_configs(self):
         default_config_dir = pathlib.Path(__file__).parent / "defaults"
@@ -80,117 +203,400 @@ class ChatGPTClient:
                 )
 
     def save_global_settings_to_disk(self):
-        with open(self.globals_file_path, "w", encoding="utf-8") as of:
-            json.dump(dataclasses.asdict(self.globals), of, indent=4, ensure_ascii=False)
+        self.globals_file.save(dataclasses.asdict(self.globals))
 
     def load_global_settings(self):
         try:
-            with open(self.globals_file_path) as f:
-                self.globals = dataclasses.replace(self.globals, **json.load(f))
+            self.globals = dataclasses.replace(self.globals, **self.globals_file.load())
         except FileNotFoundError:
             print("Global settings file is not found.")
 
     def load_presets(self):
         try:
-            with open(self.presets_file_path) as f:
-                self.presets = {preset_name: Preset(**data) for preset_name, data in json.load(f).items()}
+            self.presets = {preset_name: Preset(**data) for preset_name, data in self.presets_file.load().items()}
         except FileNotFoundError:
             print("Presets settings file is not found.")
 
+    def configs_changed_on_disk(self) -> bool:
+        return self.globals_file.changed_on_disk() or self.presets_file.changed_on_disk()
+
+    def reload_changed_configs(self) -> tuple[set[str], set[str]]:
+        """
+        Apply edits that other programs made to the config files.
+        Returns the names of the changed settings and presets, both empty if nothing changed.
+        """
+        settings, presets = {}, {}
+        try:
+            changed = self.globals_file.reload()
+            # a removed or unknown setting keeps its current value.
+            data = self.globals_file.data
+            settings = {name: data[name] for name in changed & data.keys() & GlobalSettings.__dataclass_fields__.keys()}
+            self.globals = dataclasses.replace(self.globals, **settings)
+            for conversation in self.conversations:
+                conversation.globals = dataclasses.replace(conversation.globals, **settings)
+
+            changed = self.presets_file.reload()
+            data = self.presets_file.data
+            presets = {name: (Preset(**data[name]) if name in data else None) for name in changed}
+            # in place, conversations share the presets dict.
+            for name, preset in presets.items():
+                if preset is None:
+                    self.presets.pop(name, None)
+                else:
+                    self.presets[name] = preset
+        except (ValueError, TypeError) as ex:
+            # most likely an editor in the middle of saving, the file is read again once it changes.
+            if self.globals.verbose:
+                print(f"Config reload failed: {ex}")
+        return set(settings), set(presets)
+
+    def preset_message(self, preset_name: str, role: str, text: str, header: str = "") -> Message:
+        """
+        A message for a preset field. Without random or time macros, all conversations share the same message.
+        """
+        template = compile_template(text)
+        content = template.render(MacroContext(preset_name, self.globals.user_name))
+        if template.is_static:
+            return shared_message(role, content, header)
+        return Message(role, header + content)
+
+    def greeting(self, preset_name: str) -> Message | None:
+        """
+        The preset's first message, rendered once per conversation: with {{random}} or {{time}} macros,
+        the greeting that is shown before the first turn is also the one the model gets.
+        """
+        text = self.presets.get(preset_name, Preset()).first_ai_message
+        if not text:
+            return None
+        if self._greeting is None or self._greeting[0] != (preset_name, text):
+            self._greeting = (preset_name, text), self.preset_message(preset_name, "assistant", text)
+        return self._greeting[1]
+
     def construct_initial_chat_history(self, preset_name: str):
         preset = self.presets.get(preset_name, Preset())
+        self.conversation_id = uuid.uuid4().hex
 
-        if preset.system_prompt1:
-            self.chat_history.append({"role": "system", "content": preset.system_prompt1})
-        if preset.system_prompt2:
-            self.chat_history.append({"role": "system", "content": preset.system_prompt2})
-        if preset.character_description:
-            self.chat_history.append(
-                {"role": "system", "content": "AI CHARACTER DESCRIPTION:\\n" + preset.character_description}
-            )
-        if preset.example_chat:
-            self.chat_history.append(
-                {"role": "system", "content": "EXAMPLE CHAT WITH THIS CHARACTER:\\n" + preset.example_chat}
-            )
-        if preset.world_lore:
-            self.chat_history.append({"role": "system", "content": "WORLD LORE:\\n" + preset.world_lore})
-        if preset.first_ai_message:
-            self.chat_history.append({"role": "assistant", "content": preset.first_ai_message})
+        for role, text, header in (
+            ("system", preset.system_prompt1, ""),
+            ("system", preset.system_prompt2, ""),
+            ("system", preset.character_description, "AI CHARACTER DESCRIPTION:\n"),
+            ("system", preset.example_chat, "EXAMPLE CHAT WITH THIS CHARACTER:\n"),
+            ("system", preset.world_lore, "WORLD LORE:\n"),
+        ):
+            if text:
+                self.chat_history.append(self.preset_message(preset_name, role, text, header))
+        if greeting := self.greeting(preset_name):
+            self.chat_history.append(greeting)
 
-    def send_message(self, user_message: str, preset_name: str, model_name: str = None) -> str:
+    def send_message(
+        self,
+        user_message: str,
+        preset_name: str,
+        model_name: str = None,
+        on_chunk: typing.Callable[[str], None] | None = None,
+        swipes: int = 1,
+    ) -> str:
+        """
+        Send a message and stream the reply. With swipes > 1, alternative replies are fetched as well:
+        as extra choices of the same request where the endpoint supports it, otherwise as parallel requests.
+        """
         response = None
         assistant_response = "Empty response!"
+        extra_responses = ()
+        self.swipes.reset()
 
         if not self.chat_history:
             self.construct_initial_chat_history(preset_name)
 
-        self.chat_history.append({"role": "user", "content": user_message})
+        self.chat_history.append(Message("user", user_message))
+        self.index_message("user", user_message, preset_name, model_name)
 
         preset = self.presets.get(preset_name, Preset())
         if preset.system_prompt3:
-            self.chat_history.append({"role": "system", "content": preset.system_prompt3})
+            # sent every turn, a static prompt is the same shared message each time.
+            self.chat_history.append(self.preset_message(preset_name, "system", preset.system_prompt3))
+
+        use_n = swipes > 1 and self.globals.api_type == "URL_JSON_API"
+        use_n = use_n and self.n_supported.get(self.globals.base_url, True)
+        if swipes > 1 and not use_n:
+            self.fetch_alternatives(swipes - 1, model_name)
 
+        # the request keeps its own view of the history, even if the history is changed meanwhile.
+        messages = self.chat_history.snapshot()
         if self.globals.api_type == "gpt4free":
-            response = g4f.ChatCompletion.create(
-                model=self.globals.selected_model,
-                messages=self.chat_history,
-            )
+            with self.request_slot():
+                response = self.stream_g4f_completion(messages, model_name, on_chunk)
             assistant_response = response
         elif self.globals.api_type == "URL_JSON_API":
-            headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.globals.api_key}"}
-            data = {
-                "model": (model_name or self.globals.selected_model),
-                "messages": self.chat_history,
-                "max_tokens": self.globals.max_tokens,
-                "frequency_penalty": 0.7,
-                "temperature": self.globals.temperature,
-                "presence_penalty": 0.7,
-                "top_p": 1,
-                "stream": True,
-            }
-            response = requests.post(
-                f"{self.globals.base_url}/chat/completions",
-                json=data,
-                headers=headers,
-                stream=True,
-                timeout=self.globals.timeout_sec,
+            try:
+                response = self.stream_chat_completion(messages, model_name, on_chunk, (swipes if use_n else 1))
+            except requests.HTTPError as ex:
+                # strict endpoints reject "n" outright, those also get parallel requests from now on.
+                if not (use_n and ex.response is not None and ex.response.status_code in (400, 422)):
+                    raise
+                if self.globals.verbose:
+                    print(f"The endpoint rejected n={swipes}, fetching alternatives in parallel: {ex}")
+                self.n_supported[self.globals.base_url] = use_n = False
+                self.fetch_alternatives(swipes - 1, model_name)
+                response = self.stream_chat_completion(messages, model_name, on_chunk)
+            assistant_response = response.text
+            extra_responses = response.extra
+            if use_n:
+                # endpoints that ignore "n" send a single choice, use parallel requests for them from now on.
+                self.n_supported[self.globals.base_url] = bool(extra_responses)
+                if not extra_responses:
+                    self.fetch_alternatives(swipes - 1, model_name)
+            received_chunks = response.chunks
+            for _ in range(self.globals.max_resume_attempts if self.globals.resume_truncated else 0):
+                if response.finished or not assistant_response:
+                    break
+                # the tunnel dropped mid-reply: ask the model to continue from the partial text
+                # instead of regenerating the whole reply.
+                self.stats.resumed_streams += 1
+                self.stats.saved_chunks += received_chunks
+                if self.globals.verbose:
+                    print(f"Stream was interrupted after {received_chunks} chunks, resuming.")
+                response = self.stream_chat_completion(
+                    [*messages, Message("assistant", assistant_response)],
+                    model_name,
+                    on_chunk,
+                )
+                assistant_response += response.text
+                received_chunks += response.chunks
+
+        if response:
+            try:
+                self.chat_history.append(Message("assistant", assistant_response))
+                self.swipes.message_id = self.index_message("assistant", assistant_response, preset_name, model_name)
+                self.swipes.alternatives.extend((assistant_response, *extra_responses))
+            except (IndexError, KeyError):
+                assistant_response = "The response does not contain a valid assistant message."
+        else:
+            assistant_response = "No response received."
+
+        return assistant_response
+
+    def complete(
+        self,
+        messages: typing.Sequence[Message],
+        model_name: str = None,
+        on_chunk: typing.Callable[[str], None] | None = None,
+        background: bool = False,
+    ) -> str:
+        """
+        A single reply to messages, without touching the history.
+        Background requests give way to the requests the user is waiting for.
+        """
+        if self.globals.api_type == "gpt4free":
+            with self.request_slot(background):
+                return self.stream_g4f_completion(messages, model_name, on_chunk)
+        return self.stream_chat_completion(messages, model_name, on_chunk, background=background).text
+
+    def fetch_alternatives(self, count: int, model_name: str = None):
+        """
+        Request count alternative replies to the current context in the background.
+        """
+        # the reply is appended to chat_history later, the alternatives answer what is there now.
+        messages = self.chat_history.snapshot()
+        if self.swipes.alternatives:
+            messages = messages[:-1]
+        for _ in range(count):
+            self.swipes.fetch(functools.partial(self.complete, background=True), messages, model_name)
+
+    def prefetch_alternative(self, model_name: str = None):
+        """
+        Fetch one more alternative to the last reply while the user reads it, so that a reroll is instant.
+        """
+        if self.swipes.alternatives and not self.swipes.pending:
+            self.fetch_alternatives(1, model_name)
+
+    def reroll(
+        self,
+        preset_name: str,
+        model_name: str = None,
+        on_chunk: typing.Callable[[str], None] | None = None,
+    ) -> str:
+        """
+        Replace the last reply with a new alternative, taken from the background fetches if there are any.
+        """
+        if not self.swipes.alternatives:
+            return "Nothing to reroll."
+        text = self.swipes.take_pending()
+        if text is None:
+            text = self.complete(self.chat_history[:-1], model_name, on_chunk)
+        elif on_chunk:
+            on_chunk(text)
+        self.swipes.add(text)
+        return self.use_alternative()
+
+    def select_alternative(self, index: int) -> str:
+        self.swipes.select(index)
+        return self.use_alternative()
+
+    def use_alternative(self) -> str:
+        text = self.swipes.current
+        self.chat_history[-1] = Message("assistant", text)
+        if self.globals.index_transcripts and self.swipes.message_id is not None:
+            try:
+                self.transcripts.replace(self.swipes.message_id, text)
+            except sqlite3.Error as ex:
+                if self.globals.verbose:
+                    print(ex)
+        return text
+
+    def index_message(self, role: str, content: str, preset_name: str, model_name: str = None) -> int | None:
+        if not self.globals.index_transcripts:
+            return None
+        try:
+            return self.transcripts.add(
+                self.conversation_id,
+                role,
+                content,
+                preset_name,
+                (model_name or self.globals.selected_model),
             )
-            response.raise_for_status()
+        except sqlite3.Error as ex:
+            # a broken index must never get in the way of the conversation.
+            if self.globals.verbose:
+                print(ex)
+            return None
+
+    def stream_g4f_completion(
+        self,
+        messages: typing.Sequence[Message],
+        model_name: str = None,
+        on_chunk: typing.Callable[[str], None] | None = None,
+    ) -> str:
+        """
+        Stream a reply through gpt4free.
+        With providers configured, the best ranked one is used, or several of them race if g4f_race is set.
+        """
+        model = model_name or self.globals.selected_model
+        # g4f providers expect plain dicts.
+        plain_messages: list[ChatHistoryEntry] = [message.as_dict() for message in messages]
 
-            assistant_response = ""
+        def on_g4f_chunk(chunk: str):
+            # raising here ends the g4f stream, or the race with all of its providers.
+            self.check_cancelled()
+            if on_chunk:
+                on_chunk(chunk)
+
+        if not self.globals.g4f_providers:
+            return stream_g4f(model, plain_messages, on_g4f_chunk)
+        width = max(1, self.globals.g4f_race_width) if self.globals.g4f_race else 1
+        return race_providers(
+            self.provider_scoreboard.rank(self.globals.g4f_providers)[:width],
+            model,
+            plain_messages,
+            self.provider_scoreboard,
+            on_g4f_chunk,
+        )
+
+    def stream_chat_completion(
+        self,
+        messages: typing.Sequence[Message],
+        model_name: str = None,
+        on_chunk: typing.Callable[[str], None] | None = None,
+        n: int = 1,
+        background: bool = False,
+    ) -> StreamResult:
+        """
+        Send messages to the completions endpoint and collect the streamed reply.
+        The result is marked as not finished if the stream ended without "[DONE]" or a finish reason.
+        With n > 1, only the first choice is streamed to on_chunk, the others are returned as extra.
+        """
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.globals.api_key}"}
+        data = {
+            "model": (model_name or self.globals.selected_model),
+            "max_tokens": self.globals.max_tokens,
+            "frequency_penalty": 0.7,
+            "temperature": self.globals.temperature,
+            "presence_penalty": 0.7,
+            "top_p": 1,
+            "stream": True,
+        }
+        if n > 1:
+            data["n"] = n
+        body = self.payload_encoder.encode_body(data, messages)
+        if self.globals.gzip_requests:
+            body = maybe_compress(body, headers)
+        with self.request_slot(background):
+            return self._post_stream(body, headers, on_chunk)
+
+    def _post_stream(self, body: bytes, headers: dict, on_chunk: typing.Callable[[str], None] | None) -> StreamResult:
+        start = time.perf_counter()
+        response = self.session.post(
+            f"{self.globals.base_url}/chat/completions",
+            data=body,
+            headers=headers,
+            stream=True,
+            timeout=self.globals.timeout_sec,
+        )
+        text, chunks, finished = "", 0, False
+        extra: dict[int, str] = {}
+        self.responses.add(response)
+        try:
+            self.check_cancelled()  # cancelled before the response could be shut down
+            if not response.ok:
+                # proxies explain rate limits and the like in the body, reading it also completes a recorded cassette.
+                response.content
+            response.raise_for_status()
             for line in response.iter_lines():
+                if self.cancelled.is_set():
+                    break
                 if line:
                     decoded_line = line.decode("utf-8")
                     if decoded_line == "data: [DONE]":
+                        finished = True
                         break
                     elif decoded_line.startswith("data:"):
                         json_line = json.loads(decoded_line[5:].strip())
-                        content = json_line.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        assistant_response += content
-
-        if response:
-            try:
-                self.chat_history.append({"role": "assistant", "content": assistant_response})
-            except (IndexError, KeyError):
-                assistant_response = "The response does not contain a valid assistant message."
-        else:
-            assistant_response = "No response received."
+                        for choice in json_line.get("choices") or [{}]:
+                            content = choice.get("delta", {}).get("content")
+                            if index := choice.get("index", 0):
+                                extra[index] = extra.get(index, "") + (content or "")
+                                continue
+                            if content:
+                                if not chunks:
+                                    self.record_ttft((time.perf_counter() - start) * 1000)
+                                text += content
+                                chunks += 1
+                                if on_chunk:
+                                    on_chunk(content)
+                            if choice.get("finish_reason"):
+                                finished = True
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, json.JSONDecodeError) as ex:
+            self.check_cancelled()
+            # a broken stream is only recoverable if there is something to continue from.
+            if not (self.globals.resume_truncated and text):
+                raise
+            if self.globals.verbose:
+                print(ex)
+        finally:
+            self.responses.discard(response)
+            # stopping at [DONE] or on cancel leaves the body unread, the connection has to be released explicitly.
+            response.close()
+        self.check_cancelled()
+        self.warmer.touch()
+        return StreamResult(text, chunks, finished, tuple(extra[index] for index in sorted(extra) if extra[index]))
 
-        return assistant_response
+    def record_ttft(self, ttft_ms: float):
+        if self.stats.first_ttft_ms is None:
+            self.stats.first_ttft_ms = ttft_ms
+        self.stats.last_ttft_ms = ttft_ms
 
     def set_kwargs(self, kwargs):
         self.globals = dataclasses.replace(self.globals, **{key: val for key, val in kwargs.items() if (key and val)})
 
     def save_presets_to_disk(self):
         payload = {preset_name: dataclasses.asdict(preset_data) for preset_name, preset_data in self.presets.items()}
-        with open(self.presets_file_path, "w") as file:
-            json.dump(payload, file, indent=4, ensure_ascii=False)
+        self.presets_file.save(payload)
 
     def fetch_model_names(self) -> list[str]:
         url = self.globals.base_url + "/models"
         headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.globals.api_key}"}
         try:
-            response = requests.get(url, headers=headers, timeout=25)
+            response = self.session.get(url, headers=headers, timeout=25)
             response.raise_for_status()
             json_data = response.json()
             if self.globals.verbose:
@@ -0,0 +1,114 @@
+import contextlib
+import json
+import os
+import pathlib
+import stat
+import tempfile
+import threading
+
+CONFIG_POLL_INTERVAL_SEC = 1
+_MISSING = object()
+
+
+def atomic_write_json(file_path: pathlib.Path, data: dict):
+    """
+    Write data next to the target and rename it over the target, so that a crash never leaves a half-written file.
+    """
+    file_path = pathlib.Path(os.path.realpath(file_path))  # keep symlinked dotfiles symlinked
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as of:
+            json.dump(data, of, indent=4, ensure_ascii=False)
+            of.flush()
+            os.fsync(of.fileno())
+        with contextlib.suppress(FileNotFoundError):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+def changed_keys(old: dict, new: dict) -> set[str]:
+    return {key for key in old.keys() | new.keys() if old.get(key, _MISSING) != new.get(key, _MISSING)}
+
+
+class JsonFile:
+    """
+    A JSON object on disk that remembers what it last read or wrote.
+    Saving skips the write if no top-level key changed, reload() picks up edits made by other programs.
+    """
+
+    def __init__(self, file_path: pathlib.Path):
+        self.file_path = pathlib.Path(file_path)
+        self.data: dict = {}
+        self._signature: tuple[int, int, int] | None = None
+        self._merged: set[str] = set()  # keys that save() took over from another program's edit
+        self._lock = threading.Lock()
+
+    def signature(self) -> tuple[int, int, int] | None:
+        try:
+            file_stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        # a rename gives a new inode, so atomic writes are noticed even within the mtime granularity.
+        return file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino
+
+    def changed_on_disk(self) -> bool:
+        return self.signature() != self._signature
+
+    def _read(self) -> dict:
+        with open(self.file_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self) -> dict:
+        with self._lock:
+            signature = self.signature()
+            self.data = self._read()
+            self._signature = signature
+            return self.data
+
+    def save(self, data: dict) -> set[str]:
+        """
+        Write data if it differs from the file, returns the changed keys.
+        If another program changed the file since it was last read, its edits are kept for the keys
+        that data does not change, and the next reload() reports them.
+        """
+        with self._lock:
+            signature = self.signature()
+            if None not in (signature, self._signature) and signature != self._signature:
+                try:
+                    on_disk = self._read()
+                except ValueError:
+                    pass  # an editor in the middle of saving, this save wins
+                else:
+                    ours = changed_keys(self.data, data)
+                    self._merged |= changed_keys(self.data, on_disk) - ours
+                    merged = {key: value for key, value in on_disk.items() if key not in ours}
+                    merged.update((key, data[key]) for key in ours if key in data)
+                    self.data, self._signature, data = on_disk, signature, merged
+            changed = changed_keys(self.data, data)
+            if not changed and self._signature is not None:
+                return changed
+            atomic_write_json(self.file_path, data)
+            self.data = data
+            self._signature = self.signature()
+            return changed
+
+    def reload(self) -> set[str]:
+        """
+        Read the file again if someone else changed it, returns the changed keys.
+        Raises ValueError if the file is not valid JSON (yet), the next call tries again.
+        """
+        with self._lock:
+            changed = set()
+            signature = self.signature()
+            if signature is not None and signature != self._signature:
+                data = self._read()
+                changed = changed_keys(self.data, data)
+                self.data = data
+                self._signature = signature
+            changed |= self._merged
+            self._merged = set()
+            return changed
@@ -0,0 +1 @@
+PROGRAM_NAME = "rp4"
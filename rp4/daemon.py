@@ -0,0 +1,242 @@
+import dataclasses
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+from rp4.config import CONFIG_POLL_INTERVAL_SEC
+from rp4.consts import PROGRAM_NAME
+
+STARTUP_TIMEOUT_SEC = 15
+IDLE_CHECK_INTERVAL_SEC = 5
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+def socket_path() -> pathlib.Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return pathlib.Path(runtime_dir) / f"{PROGRAM_NAME}-{os.getuid()}" / "daemon.sock"
+
+
+def private_socket_path() -> pathlib.Path:
+    """
+    socket_path(), after making sure that only the current user can create or reach a socket there.
+    Without XDG_RUNTIME_DIR the directory is in the shared temp dir, where another user may have created it first.
+    """
+    path = socket_path()
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    dir_stat = os.lstat(path.parent)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or stat.S_IMODE(dir_stat.st_mode) & 0o077:
+        raise DaemonError(f"{path.parent} must be a directory owned by you and accessible only to you (mode 700).")
+    return path
+
+
+@dataclasses.dataclass
+class DaemonSession:
+    client: typing.Any  # ChatGPTClient
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: pathlib.Path, client):
+        self.client = client
+        self.sessions: dict[str, DaemonSession] = {}
+        self.sessions_lock = threading.Lock()
+        self.active_requests = 0
+        self.last_activity = time.monotonic()
+        super().__init__(str(path), RequestHandler)
+
+    def get_session(self, name: str | None) -> DaemonSession:
+        if not name:
+            # unnamed requests behave like a standalone `rp4 --ask` call.
+            return DaemonSession(self.client.new_conversation())
+        with self.sessions_lock:
+            if name not in self.sessions:
+                self.sessions[name] = DaemonSession(self.client.new_conversation())
+            return self.sessions[name]
+
+    def track_request(self, delta: int):
+        with self.sessions_lock:
+            self.active_requests += delta
+            self.last_activity = time.monotonic()
+
+    def shutdown_when_idle(self):
+        while True:
+            time.sleep(IDLE_CHECK_INTERVAL_SEC)
+            with self.sessions_lock:
+                idle_sec = time.monotonic() - self.last_activity
+                if self.active_requests == 0 and idle_sec > self.client.globals.daemon_idle_sec:
+                    break
+        self.shutdown()
+
+    def watch_configs(self):
+        # sessions share the presets and get changed settings through the client, see reload_changed_configs.
+        while True:
+            time.sleep(CONFIG_POLL_INTERVAL_SEC)
+            changed_settings, changed_presets = self.client.reload_changed_configs()
+            if self.client.globals.verbose and (changed_settings or changed_presets):
+                print(f"Reloaded settings {sorted(changed_settings)} and presets {sorted(changed_presets)}")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks JSON lines: one request line, then any number of {"chunk": ...} lines
+    and a final {"done": ...} or {"error": ...} line.
+    """
+
+    server: DaemonServer
+
+    def send(self, **message):
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return self.send(error="Malformed request.")
+        self.server.track_request(+1)
+        try:
+            match request.get("op"):
+                case "ask":
+                    self.ask(request)
+                case "ping":
+                    self.send(done=True)
+                case "stop":
+                    self.send(done=True)
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                case op:
+                    self.send(error=f"Unknown operation: {op}")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as ex:
+            self.send(error=f"An error occurred: {ex}")
+        finally:
+            self.server.track_request(-1)
+
+    def ask(self, request: dict):
+        session = self.server.get_session(request.get("session"))
+        with session.lock:
+            session.client.warmer.poke()
+            reply = session.client.send_message(
+                request["message"],
+                (request.get("preset") or session.client.globals.selected_preset),
+                request.get("model"),
+                on_chunk=lambda chunk: self.send(chunk=chunk),
+            )
+        self.send(done=True, reply=reply)
+
+
+def serve():
+    """
+    Run the daemon in the foreground until it is stopped or idles out.
+    """
+    from rp4.client import ChatGPTClient
+
+    path = private_socket_path()
+    if is_running():
+        return
+    path.unlink(missing_ok=True)  # stale socket left by a killed daemon
+    client = ChatGPTClient()
+    with DaemonServer(path, client) as server:
+        os.chmod(path, 0o600)
+        threading.Thread(target=server.shutdown_when_idle, daemon=True).start()
+        threading.Thread(target=server.watch_configs, daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            client.warmer.stop()
+            path.unlink(missing_ok=True)
+
+
+def connect() -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(private_socket_path()))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def is_running() -> bool:
+    try:
+        connect().close()
+    except OSError:
+        return False
+    return True
+
+
+def start():
+    subprocess.Popen(
+        [sys.executable, "-m", PROGRAM_NAME, "--serve-daemon"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        if is_running():
+            return
+        time.sleep(0.05)
+    raise DaemonError("The daemon did not start in time.")
+
+
+def request(payload: dict, autostart: bool = True) -> typing.Iterator[dict]:
+    """
+    Send a request to the daemon, starting it if needed, and yield its replies.
+    """
+    try:
+        sock = connect()
+    except OSError:
+        if not autostart:
+            raise DaemonError("The daemon is not running.")
+        start()
+        sock = connect()
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "error" in message:
+                raise DaemonError(message["error"])
+            yield message
+            if message.get("done"):
+                return
+    raise DaemonError("The daemon closed the connection.")
+
+
+def ask(
+    message: str,
+    preset_name: str | None = None,
+    model_name: str | None = None,
+    session: str | None = None,
+    on_chunk: typing.Callable[[str], None] | None = None,
+) -> str:
+    payload = {"op": "ask", "message": message, "preset": preset_name, "model": model_name, "session": session}
+    for reply in request(payload):
+        if "chunk" in reply and on_chunk:
+            on_chunk(reply["chunk"])
+        if reply.get("done"):
+            return reply["reply"]
+
+
+def stop():
+    try:
+        for _ in request({"op": "stop"}, autostart=False):
+            pass
+    except DaemonError:
+        pass
@@ -1,6 +1,6 @@
 import pathlib
 
-from rp4.client import PROGRAM_NAME
+from rp4.consts import PROGRAM_NAME
 
 LAUNCH_INFO = f"""\
 [Desktop Entry]
@@ -1,12 +1,20 @@
-import datetime
+import dataclasses
+import pathlib
+import re
 import sys
+from pprint import pprint
 
-import markdown2
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
-from PyQt6.QtGui import QKeyEvent
+from PyQt6.QtCore import QThread, pyqtSignal, Qt, QTimer
+from PyQt6.QtGui import QKeyEvent, QTextCursor
 from PyQt6.QtWidgets import *
 
-from rp4.client import ChatGPTClient, Preset, FetchError, GlobalSettings, PROGRAM_NAME
+from rp4.client import ChatGPTClient, Preset, FetchError
+from rp4.config import CONFIG_POLL_INTERVAL_SEC
+from rp4.consts import PROGRAM_NAME
+from rp4.history import Message
+from rp4.profiling import RenderProfiler, STALL_CHECK_INTERVAL_MS
+from rp4.render import render_body, render_header, render_message
+from rp4.search import SearchHit
 
 
 def generate_theme_style(
@@ -196,18 +204,33 @@ dark_theme_style = generate_theme_style(
 )
 
 
+STREAM_REFRESH_MS = 50
+SAVE_DELAY_MS = 1500
+WORKER_EXIT_TIMEOUT_MS = 3000
+PRESET_FIELDS = [field.name for field in dataclasses.fields(Preset)]  # named like their text fields
+
+
 class Worker(QThread):
     finished = pyqtSignal(str)  # todo pass struct with fields (msg, role)
+    progress = pyqtSignal(str)
 
-    def __init__(self, chatgpt_client: ChatGPTClient, user_message: str, preset_name: str):
+    def __init__(self, chatgpt_client: ChatGPTClient, user_message: str | None, preset_name: str):
         super().__init__()
         self.chatgpt_client = chatgpt_client
-        self.user_message = user_message
+        self.user_message = user_message  # None rerolls the last reply
         self.preset_name = preset_name
 
     def run(self):
         try:
-            assistant_response = self.chatgpt_client.send_message(self.user_message, self.preset_name)
+            if self.user_message is None:
+                assistant_response = self.chatgpt_client.reroll(self.preset_name, on_chunk=self.progress.emit)
+            else:
+                assistant_response = self.chatgpt_client.send_message(
+                    self.user_message,
+                    self.preset_name,
+                    on_chunk=self.progress.emit,
+                    swipes=self.chatgpt_client.globals.swipes,
+                )
             self.finished.emit(assistant_response)
         except Exception as e:
             self.finished.emit(f"An error occurred: {e}")
@@ -215,37 +238,340 @@ class Worker(QThread):
 
 class UserMsgForm(QTextEdit):
     sendPressed = pyqtSignal()
+    keyPressed = pyqtSignal()
 
     def keyPressEvent(self, event: QKeyEvent | None):
+        self.keyPressed.emit()
         if event.key() == Qt.Key.Key_Return and event.modifiers() == Qt.KeyboardModifier.ControlModifier:
             self.sendPressed.emit()
         else:
             super().keyPressEvent(event)
 
 
-def highlight_quoted_text(message, color):
-    quote = '"'
-    quote_pairs = message.split(quote)
-    for i in range(1, len(quote_pairs), 2):
-        quote_pairs[i] = f'<span style="color: {color};">{quote_pairs[i]}</span>'
-    return quote.join(quote_pairs)
+class ChatTab(QWidget):
+    """
+    One conversation: its own client (history and model), preset, message box and in-flight reply.
+    Rendering is skipped while the tab is hidden and caught up when it is shown.
+    """
+
+    def __init__(self, gui: "ChatGUI", chatgpt_client: ChatGPTClient, preset_name: str):
+        super().__init__()
+        self.gui = gui
+        self.chatgpt_client = chatgpt_client
+        self.preset_name = preset_name
+        self.worker = None
+        self.generating = False
+        self.stream_text = ""
+        self.stream_start: int | None = None
+        self.stream_refresh_pending = False
+        self.reply_start: int | None = None
+        self.backlog: list[tuple[str, str, int | None]] = []
+        self.message_positions: dict[int, int] = {}
+        self.init_ui()
+
+    def init_ui(self):
+        chat_layout = QVBoxLayout(self)
+        self.messages_text = QTextEdit(self)
+        self.messages_text.setObjectName("messages_text")
+        self.messages_text.setReadOnly(True)
+        self.messages_text.setStyleSheet(f"font-size: {self.gui.font_size}px")
+        chat_layout.addWidget(self.messages_text)
+
+        self.user_message = UserMsgForm(self)
+        self.user_message.setAcceptRichText(False)
+        self.user_message.setMinimumHeight(100)
+        self.user_message.setMaximumHeight(200)
+        self.user_message.sendPressed.connect(self.send_message)
+        self.user_message.keyPressed.connect(self.chatgpt_client.warmer.poke)
+        chat_layout.addWidget(self.user_message)
+
+        self.send_button = QPushButton("Send", self)
+        self.send_button.clicked.connect(self.send_message)
+        self.send_button.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
+
+        self.clear_history_button = QPushButton("Clear history")
+        self.clear_history_button.clicked.connect(self.clear_history)
+
+        # swipes: switch between alternative replies to the last message or fetch another one
+        self.previous_swipe_button = QPushButton("◀", self)
+        self.previous_swipe_button.clicked.connect(lambda: self.show_alternative(-1))
+        self.swipe_label = QLabel(self)
+        self.next_swipe_button = QPushButton("▶", self)
+        self.next_swipe_button.clicked.connect(lambda: self.show_alternative(+1))
+        self.reroll_button = QPushButton("Reroll", self)
+        self.reroll_button.clicked.connect(self.reroll)
+        self.update_swipe_controls()
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.previous_swipe_button)
+        button_layout.addWidget(self.swipe_label)
+        button_layout.addWidget(self.next_swipe_button)
+        button_layout.addWidget(self.reroll_button)
+        button_layout.addWidget(self.send_button)
+        button_layout.addWidget(self.clear_history_button)
+        chat_layout.addLayout(button_layout)
 
+    def clear_history(self):
+        self.messages_text.clear()
+        self.backlog.clear()
+        self.message_positions.clear()
+        self.stream_start = None
+        self.reply_start = None
+        self.chatgpt_client.chat_history.clear()
+        self.chatgpt_client.swipes.reset()
+        self.update_swipe_controls()
+
+    def send_message(self) -> None:
+        user_message = self.user_message.toPlainText()
+        if not user_message or self.generating:
+            return
+
+        self.gui.sync_settings_with_backend()
+
+        self.update_ui(user_message, is_user=True)
+
+        self.generating = True
+        self.worker = Worker(self.chatgpt_client, user_message, self.preset_name)
+        self.worker.progress.connect(self.on_stream_chunk)
+        self.worker.finished.connect(self.update_ui)
+        self.worker.start()
+        self.gui.update_tab_title(self)
+        self.update_swipe_controls()
+
+    def reroll(self):
+        if self.generating or not self.chatgpt_client.swipes.alternatives:
+            return
+        self.gui.sync_settings_with_backend()
+        # the new reply streams over the old one.
+        self.stream_start = self.reply_start
+        self.generating = True
+        self.worker = Worker(self.chatgpt_client, None, self.preset_name)
+        self.worker.progress.connect(self.on_stream_chunk)
+        self.worker.finished.connect(self.on_alternative)
+        self.worker.start()
+        self.gui.update_tab_title(self)
+        self.update_swipe_controls()
+
+    def show_alternative(self, step: int):
+        swipes = self.chatgpt_client.swipes
+        if self.generating or not swipes.alternatives:
+            return
+        index = swipes.selected + step
+        if index >= len(swipes.alternatives):
+            return self.reroll()
+        if index >= 0:
+            self.stream_start = self.reply_start
+            self.on_alternative(self.chatgpt_client.select_alternative(index))
+
+    def on_alternative(self, message: str):
+        self.generating = False
+        self.stream_text = ""
+        self.post_message(message, self.preset_name)
+        self.gui.update_tab_title(self)
+        self.update_swipe_controls()
+        self.prefetch_alternative()
+
+    def prefetch_alternative(self):
+        if self.chatgpt_client.globals.prefetch_swipe:
+            self.chatgpt_client.prefetch_alternative()
+
+    def update_swipe_controls(self):
+        swipes = self.chatgpt_client.swipes
+        enabled = bool(swipes.alternatives) and not self.generating
+        self.swipe_label.setText(f"{swipes.selected + 1}/{len(swipes.alternatives)}" if swipes.alternatives else "")
+        self.previous_swipe_button.setEnabled(enabled and swipes.selected > 0)
+        self.next_swipe_button.setEnabled(enabled)
+        self.reroll_button.setEnabled(enabled)
+
+    def post_message(self, message: str, role: str, message_id: int | None = None):
+        self.backlog.append((message, role, message_id))
+        if self.isVisible():
+            self.flush_backlog()
+
+    def flush_backlog(self):
+        for message, role, message_id in self.backlog:
+            document = self.messages_text.document()
+            if self.stream_start is not None:
+                start = self.stream_start
+            else:
+                # the first message goes into the empty first block, the others into a new one at the end.
+                start = 0 if document.isEmpty() else document.characterCount()
+            if message_id is not None:
+                self.message_positions[message_id] = start
+            html = self.gui.format_message(message, role)
+            with self.gui.profiler.stage("qt_append_layout"):
+                if self.stream_start is not None:
+                    # the finished reply replaces its streamed preview.
+                    self.replace_stream_block(html)
+                    self.stream_start = None
+                else:
+                    self.messages_text.append(html)
+            # remembered so that another alternative can take the place of the reply.
+            self.reply_start = None if role == "User" else start
+        self.backlog.clear()
+        if self.stream_text:
+            self.refresh_stream()
+
+    def on_stream_chunk(self, chunk: str):
+        self.stream_text += chunk
+        if not self.stream_refresh_pending and self.isVisible():
+            # coalesce chunks, re-rendering the reply on every token would stall the event loop.
+            self.stream_refresh_pending = True
+            QTimer.singleShot(STREAM_REFRESH_MS, self.refresh_stream)
+
+    def refresh_stream(self):
+        self.stream_refresh_pending = False
+        if not self.stream_text or not self.isVisible():
+            return
+        with self.gui.profiler.stage("stream_refresh"):
+            if self.stream_start is None:
+                self.messages_text.append("")
+                self.stream_start = self.messages_text.document().characterCount() - 1
+            html = render_header(self.preset_name) + render_body(
+                self.stream_text, self.chatgpt_client.globals.md2html, self.gui.profiler.stage
+            )
+            self.replace_stream_block(html)
+
+    def replace_stream_block(self, html: str):
+        cursor = QTextCursor(self.messages_text.document())
+        cursor.setPosition(self.stream_start)
+        cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
+        cursor.insertHtml(html)
+        scrollbar = self.messages_text.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+
+    def update_ui(self, message: str, is_user: bool = False):
+        role = "User" if is_user else self.preset_name
+        if not is_user:
+            self.generating = False
+            self.stream_text = ""
+        self.post_message(message, role)
+        if is_user:
+            self.user_message.clear()
+            self.user_message.setDisabled(True)
+            self.send_button.setDisabled(True)
+        else:
+            self.user_message.clear()
+            self.user_message.setDisabled(False)
+            self.send_button.setDisabled(False)
+            self.user_message.setFocus()
+            self.gui.update_tab_title(self)
+            self.update_swipe_controls()
+            self.prefetch_alternative()
+            if self.chatgpt_client.globals.verbose:
+                pprint(dataclasses.asdict(self.chatgpt_client.stats))
+
+    def load_conversation(self, conversation_id: str):
+        """
+        Continue a saved conversation: rebuild the preset's system messages and replay the indexed messages.
+        """
+        self.clear_history()
+        self.chatgpt_client.construct_initial_chat_history(self.preset_name)
+        self.chatgpt_client.conversation_id = conversation_id
+        for message_id, role, content in self.chatgpt_client.transcripts.conversation(conversation_id):
+            self.chatgpt_client.chat_history.append(Message(role, content))
+            self.post_message(content, ("User" if role == "user" else self.preset_name), message_id)
+
+    def scroll_to_hit(self, hit: SearchHit):
+        cursor = QTextCursor(self.messages_text.document())
+        cursor.setPosition(min(self.message_positions.get(hit.message_id, 0), cursor.document().characterCount() - 1))
+        self.messages_text.setTextCursor(cursor)
+        if match := re.search(r"\[(.+?)]", hit.snippet):
+            self.messages_text.find(match[1])
+        self.messages_text.ensureCursorVisible()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.flush_backlog()
+
+    def stop(self):
+        """
+        Cancel the reply in flight and the background fetches, the tab continues with a new conversation.
+        """
+        self.generating = False
+        if self.worker and self.worker.isRunning():
+            # a late reply is ignored. terminating the thread would leak its request slot and connection,
+            # the cancelled request gives them back at its next chunk and the thread ends by itself.
+            self.worker.progress.disconnect()
+            self.worker.finished.disconnect()
+            self.gui.stopped_workers.add(self.worker)
+            # update_ui no longer runs for this reply, so the input is given back here.
+            self.stream_text = ""
+            self.user_message.setDisabled(False)
+            self.send_button.setDisabled(False)
+        self.gui.stopped_workers = {worker for worker in self.gui.stopped_workers if worker.isRunning()}
+        self.worker = None
+        self.chatgpt_client.cancel()
+        self.chatgpt_client = self.chatgpt_client.new_conversation()
+        self.gui.update_tab_title(self)
+        self.update_swipe_controls()
+
+
+class SearchDialog(QDialog):
+    def __init__(self, gui: "ChatGUI", query: str):
+        super().__init__(gui)
+        self.setWindowTitle("Search conversations")
+        self.setMinimumSize(600, 400)
+        self.gui = gui
+        self.hit: SearchHit | None = None
+
+        self.query_field = QLineEdit(query, self)
+        self.query_field.textChanged.connect(self.run_search)
+        self.preset_filter = QComboBox(self)
+        self.preset_filter.addItem("Any preset", None)
+        for preset_name in gui.chatgpt_client.presets:
+            self.preset_filter.addItem(preset_name, preset_name)
+        self.preset_filter.currentIndexChanged.connect(self.run_search)
+        self.model_filter = QComboBox(self)
+        self.model_filter.addItem("Any model", None)
+        for model_name in gui.chatgpt_client.globals.model_names:
+            self.model_filter.addItem(model_name, model_name)
+        self.model_filter.currentIndexChanged.connect(self.run_search)
+        self.results = QListWidget(self)
+        self.results.itemActivated.connect(self.open_hit)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.query_field)
+        hbox.addWidget(self.preset_filter)
+        hbox.addWidget(self.model_filter)
+        layout = QVBoxLayout(self)
+        layout.addLayout(hbox)
+        layout.addWidget(self.results)
+        self.run_search()
+
+    def run_search(self):
+        self.results.clear()
+        hits = self.gui.chatgpt_client.transcripts.search(
+            self.query_field.text(),
+            preset=self.preset_filter.currentData(),
+            model=self.model_filter.currentData(),
+            limit=100,
+        )
+        for hit in hits:
+            item = QListWidgetItem(f"{hit.created:%Y-%m-%d %H:%M}  {hit.preset}  {hit.role}: {hit.snippet}")
+            item.setData(Qt.ItemDataRole.UserRole, hit)
+            self.results.addItem(item)
 
-def wrap_code_blocks(message):
-    code_block = "```"
-    block_pairs = message.split(code_block)
-    for i in range(1, len(block_pairs), 2):
-        block_pairs[i] = f"<pre>{block_pairs[i]}</pre>"
-    return code_block.join(block_pairs)
+    def open_hit(self, item: QListWidgetItem):
+        self.hit = item.data(Qt.ItemDataRole.UserRole)
+        self.accept()
 
 
 class ChatGUI(QWidget):
-    def __init__(self, chatgpt_client: ChatGPTClient, app: QApplication):
+    def __init__(self, chatgpt_client: ChatGPTClient, app: QApplication, profiler: RenderProfiler | None = None):
         super().__init__()
         self.chatgpt_client = chatgpt_client
         self.app = app
-        self.worker = None
+        self.profiler = profiler or RenderProfiler()
+        self.font_size = 16
+        self.active_tab: ChatTab | None = None
+        self.stopped_workers: set[Worker] = set()  # cancelled, kept alive until their thread returns
         self.init_ui()
+        if self.profiler.enabled:
+            self.stall_timer = QTimer(self)
+            self.stall_timer.timeout.connect(self.profiler.heartbeat)
+            self.stall_timer.start(STALL_CHECK_INTERVAL_MS)
+            self.profiler.start()
 
     def switch_theme(self, theme):
         if theme == "Dark":
@@ -264,21 +590,10 @@ class ChatGUI(QWidget):
         self.populate_model_dropdown(self.model_dropdown.currentText())
 
     def init_ui(self):
-        chat_layout = QVBoxLayout()
-        self.messages_text = QTextEdit(self)
-        self.messages_text.setObjectName("messages_text")
-        self.messages_text.setReadOnly(True)
-        chat_layout.addWidget(self.messages_text)
-
-        self.user_message = UserMsgForm(self)
-        # self.user_message.enterEvent.connect(self.send_message)
-        self.user_message.setAcceptRichText(False)
-        self.user_message.setMinimumHeight(100)
-        self.user_message.setMaximumHeight(200)
-        self.user_message.sendPressed.connect(self.send_message)
-        chat_layout.addWidget(self.user_message)
-
-        self.font_size = 16
+        self.tabs = QTabWidget(self)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.tabCloseRequested.connect(self.close_tab)
 
         self.increase_font_button = QPushButton("+", self)
         self.increase_font_button.setFixedSize(32, 32)
@@ -288,20 +603,25 @@ class ChatGUI(QWidget):
         self.decrease_font_button.setFixedSize(32, 32)
         self.decrease_font_button.clicked.connect(self.decrease_font_size)
 
-        self.send_button = QPushButton("Send", self)
-        self.send_button.clicked.connect(self.send_message)
-        self.send_button.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
+        self.new_tab_button = QPushButton("New chat", self)
+        self.new_tab_button.clicked.connect(lambda: self.add_tab(self.preset_dropdown.currentText()))
 
-        self.clear_history_button = QPushButton("Clear history")
-        self.clear_history_button.clicked.connect(self.clear_history)
+        corner = QWidget(self)
+        corner_layout = QHBoxLayout(corner)
+        corner_layout.setContentsMargins(0, 0, 0, 0)
+        corner_layout.addWidget(self.decrease_font_button)
+        corner_layout.addWidget(self.increase_font_button)
+        corner_layout.addWidget(self.new_tab_button)
+        self.tabs.setCornerWidget(corner)
 
-        button_layout = QHBoxLayout()
-        button_layout.addWidget(self.decrease_font_button)
-        button_layout.addWidget(self.increase_font_button)
-        button_layout.addWidget(self.send_button)
-        button_layout.addWidget(self.clear_history_button)
+        self.search_field = QLineEdit(self)
+        self.search_field.setPlaceholderText("Search conversations…")
+        self.search_field.returnPressed.connect(self.search_transcripts)
 
-        chat_layout.addLayout(button_layout)
+        chat_layout = QVBoxLayout()
+        chat_layout.setContentsMargins(0, 0, 0, 0)
+        chat_layout.addWidget(self.search_field)
+        chat_layout.addWidget(self.tabs)
 
         settings_layout = QVBoxLayout()
 
@@ -312,6 +632,17 @@ class ChatGUI(QWidget):
         settings_layout.addWidget(QLabel("Select API:"))
         settings_layout.addWidget(self.api_dropdown)
 
+        self.g4f_providers_field = QLineEdit(self)
+        self.g4f_providers_field.setPlaceholderText("Let gpt4free choose")
+        self.g4f_providers_field.setText(", ".join(self.chatgpt_client.globals.g4f_providers))
+        self.g4f_race_checkbox = QCheckBox("Race")
+        self.g4f_race_checkbox.setChecked(self.chatgpt_client.globals.g4f_race)
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("gpt4free providers:"))
+        hbox.addWidget(self.g4f_providers_field)
+        hbox.addWidget(self.g4f_race_checkbox)
+        settings_layout.addLayout(hbox)
+
         self.base_url_field = QLineEdit(self)
         self.base_url_field.setText(self.chatgpt_client.globals.base_url)
         self.base_url_field.editingFinished.connect(self.update_base_url)
@@ -341,6 +672,7 @@ class ChatGUI(QWidget):
 
         # model dropdown (gpt-4, etc.)
         self.model_dropdown = QComboBox(self)
+        self.model_dropdown.currentTextChanged.connect(self.update_tab_model)
         settings_layout.addWidget(QLabel("Select Model:"))
         settings_layout.addWidget(self.model_dropdown)
         self.populate_model_dropdown(self.chatgpt_client.globals.selected_model)
@@ -349,6 +681,25 @@ class ChatGUI(QWidget):
         self.format_md_checkbox.setChecked(self.chatgpt_client.globals.md2html)
         settings_layout.addWidget(self.format_md_checkbox)
 
+        self.resume_truncated_checkbox = QCheckBox("Resume interrupted replies")
+        self.resume_truncated_checkbox.setChecked(self.chatgpt_client.globals.resume_truncated)
+        settings_layout.addWidget(self.resume_truncated_checkbox)
+
+        self.warmup_checkbox = QCheckBox("Keep connection warm")
+        self.warmup_checkbox.setChecked(self.chatgpt_client.globals.warmup)
+        settings_layout.addWidget(self.warmup_checkbox)
+
+        self.swipes_spinbox = QSpinBox()
+        self.swipes_spinbox.setRange(1, 8)
+        self.swipes_spinbox.setValue(self.chatgpt_client.globals.swipes)
+        self.prefetch_swipe_checkbox = QCheckBox("Prefetch a reroll")
+        self.prefetch_swipe_checkbox.setChecked(self.chatgpt_client.globals.prefetch_swipe)
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Alternatives:"))
+        hbox.addWidget(self.swipes_spinbox)
+        hbox.addWidget(self.prefetch_swipe_checkbox)
+        settings_layout.addLayout(hbox)
+
         # Max tokens and temperature
         self.max_tokens_spinbox = QSpinBox()
         self.max_tokens_spinbox.setRange(1, 9999)
@@ -365,6 +716,14 @@ class ChatGUI(QWidget):
         hbox.addWidget(self.temperature_spinbox)
         settings_layout.addLayout(hbox)
 
+        # {{user}} in presets
+        self.user_name_field = QLineEdit(self)
+        self.user_name_field.setText(self.chatgpt_client.globals.user_name)
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Your name:"))
+        hbox.addWidget(self.user_name_field)
+        settings_layout.addLayout(hbox)
+
         # HR
         hline = QFrame(self)
         hline.setObjectName("line")
@@ -421,10 +780,6 @@ class ChatGUI(QWidget):
         self.save_settings_button.clicked.connect(self.save_settings_to_disk)
         settings_layout.addWidget(self.save_settings_button)
 
-        # Chat history + input box
-        chat_area = QWidget()
-        chat_area.setLayout(chat_layout)
-
         # Chat settings
         setting_widget = QWidget()
         setting_widget.setLayout(settings_layout)
@@ -437,6 +792,8 @@ class ChatGUI(QWidget):
         # Splitter
         splitter = QSplitter()
         # Left tab
+        chat_area = QWidget()
+        chat_area.setLayout(chat_layout)
         splitter.addWidget(chat_area)
         # Right tab
         splitter.addWidget(settings_area)
@@ -451,26 +808,121 @@ class ChatGUI(QWidget):
         self.api_dropdown.setCurrentText(self.chatgpt_client.globals.api_type)
 
         #  Populate presets (and system prompt fields)
+        self.add_tab(self.chatgpt_client.globals.selected_preset)
+        self.tabs.currentChanged.connect(self.switch_tab)
         self.populate_preset_names()
         self.preset_dropdown.currentTextChanged.connect(self.apply_preset)
 
-        # Focus message box
-        self.user_message.setFocus()
+        # Save edits once they settle, and pick up edits made by other programs
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.save_settings_to_disk)
+        for signal in (
+            self.api_dropdown.currentTextChanged,
+            self.g4f_providers_field.editingFinished,
+            self.g4f_race_checkbox.toggled,
+            self.base_url_field.editingFinished,
+            self.api_key_field.editingFinished,
+            self.user_name_field.editingFinished,
+            self.theme_dropdown.currentTextChanged,
+            self.model_dropdown.currentTextChanged,
+            self.format_md_checkbox.toggled,
+            self.resume_truncated_checkbox.toggled,
+            self.warmup_checkbox.toggled,
+            self.swipes_spinbox.valueChanged,
+            self.prefetch_swipe_checkbox.toggled,
+            self.max_tokens_spinbox.valueChanged,
+            self.temperature_spinbox.valueChanged,
+            self.preset_dropdown.currentTextChanged,
+            *(self.preset_field(name).textChanged for name in PRESET_FIELDS),
+        ):
+            signal.connect(self.save_timer.start)
+        self.config_timer = QTimer(self)
+        self.config_timer.timeout.connect(self.reload_configs)
+        self.config_timer.start(CONFIG_POLL_INTERVAL_SEC * 1000)
+
+        # Open a connection to the endpoint before the first message
+        self.chatgpt_client.warmer.poke()
+
+    @property
+    def current_tab(self) -> ChatTab:
+        return self.tabs.currentWidget()
+
+    def add_tab(self, preset_name: str) -> ChatTab:
+        tab = ChatTab(self, self.chatgpt_client.new_conversation(), preset_name)
+        self.tabs.addTab(tab, preset_name or "Chat")
+        self.tabs.setCurrentWidget(tab)
+        if greeting := tab.chatgpt_client.greeting(preset_name):
+            tab.post_message(greeting.content, preset_name)
+        tab.user_message.setFocus()
+        return tab
+
+    def close_tab(self, index: int):
+        if self.tabs.count() < 2:
+            return
+        tab = self.tabs.widget(index)
+        if tab is self.active_tab:
+            self.active_tab = None
+        tab.stop()
+        self.tabs.removeTab(index)
+        tab.deleteLater()
+
+    def search_transcripts(self):
+        dialog = SearchDialog(self, self.search_field.text())
+        if dialog.exec() and dialog.hit:
+            self.open_search_hit(dialog.hit)
+
+    def open_search_hit(self, hit: SearchHit):
+        for index in range(self.tabs.count()):
+            if (tab := self.tabs.widget(index)).chatgpt_client.conversation_id == hit.conversation:
+                self.tabs.setCurrentWidget(tab)
+                break
+        else:
+            tab = self.add_tab(hit.preset)
+            tab.load_conversation(hit.conversation)
+        tab.scroll_to_hit(hit)
+
+    def update_tab_title(self, tab: ChatTab):
+        title = tab.preset_name or "Chat"
+        self.tabs.setTabText(self.tabs.indexOf(tab), f"{title} …" if tab.generating else title)
+
+    def switch_tab(self, index: int):
+        if self.active_tab is not None and self.active_tab.preset_name in self.chatgpt_client.presets:
+            # keep edits of the previous tab's preset before the fields are reloaded.
+            self.sync_preset(self.active_tab.preset_name)
+        self.active_tab = tab = self.tabs.widget(index)
+        if tab is None:
+            return
+        self.preset_dropdown.blockSignals(True)
+        self.preset_dropdown.setCurrentText(tab.preset_name)
+        self.preset_dropdown.blockSignals(False)
+        self.load_preset_fields(self.chatgpt_client.presets.get(tab.preset_name, Preset()))
+        self.model_dropdown.setCurrentText(tab.chatgpt_client.globals.selected_model)
+        tab.user_message.setFocus()
+
+    def update_tab_model(self, model_name: str):
+        if model_name and self.tabs.count():
+            self.current_tab.chatgpt_client.globals.selected_model = model_name
 
     def populate_preset_names(self):
         self.preset_dropdown.clear()
         self.preset_dropdown.addItems(self.chatgpt_client.presets)
         self.preset_dropdown.setCurrentText(self.chatgpt_client.globals.selected_preset)
-        self.apply_preset(self.chatgpt_client.globals.selected_preset)
+        self.load_preset_fields(self.chatgpt_client.presets.get(self.current_tab.preset_name, Preset()))
+        self.active_tab = self.current_tab
+
+    def set_font_size(self, font_size: int):
+        self.font_size = font_size
+        for index in range(self.tabs.count()):
+            self.tabs.widget(index).messages_text.setStyleSheet(f"font-size: {self.font_size}px")
 
     def increase_font_size(self):
-        self.font_size += 1
-        self.messages_text.setStyleSheet(f"font-size: {self.font_size}px")
+        self.set_font_size(self.font_size + 1)
 
     def decrease_font_size(self):
         if self.font_size > 1:
-            self.font_size -= 1
-            self.messages_text.setStyleSheet(f"font-size: {self.font_size}px")
+            self.set_font_size(self.font_size - 1)
 
     def update_base_url(self):
         if self.base_url_field.text() and self.base_url_field.text() != self.chatgpt_client.globals.base_url:
@@ -481,58 +933,140 @@ class ChatGUI(QWidget):
         """
         dump current settings from the GUI layout.
         """
-        return GlobalSettings(
+        return dataclasses.replace(
+            self.chatgpt_client.globals,  # echo back settings that have no widgets
             api_type=self.api_dropdown.currentText(),
             api_key=self.api_key_field.text(),
+            user_name=self.user_name_field.text(),
             base_url=self.base_url_field.text(),
             selected_model=self.model_dropdown.currentText(),
             theme=self.theme_dropdown.currentText(),
             model_names=[self.model_dropdown.itemText(item) for item in range(self.model_dropdown.count())],
             selected_preset=self.preset_dropdown.currentText(),
-            verbose=self.chatgpt_client.globals.verbose,  # echo back
             md2html=self.format_md_checkbox.isChecked(),
             max_tokens=self.max_tokens_spinbox.value(),
             temperature=self.temperature_spinbox.value(),
+            resume_truncated=self.resume_truncated_checkbox.isChecked(),
+            warmup=self.warmup_checkbox.isChecked(),
+            g4f_providers=[name.strip() for name in self.g4f_providers_field.text().split(",") if name.strip()],
+            g4f_race=self.g4f_race_checkbox.isChecked(),
+            swipes=self.swipes_spinbox.value(),
+            prefetch_swipe=self.prefetch_swipe_checkbox.isChecked(),
         )
 
     def sync_settings_with_backend(self):
-        # global settings
+        # global settings, the current tab gets its own copy so that its model stays its own
         self.chatgpt_client.globals = self._current_settings_from_gui()
+        self.current_tab.chatgpt_client.globals = dataclasses.replace(self.chatgpt_client.globals)
         # presets
         if current_preset_name := self.preset_dropdown.currentText():
-            self.chatgpt_client.presets[current_preset_name] = self._get_current_preset_from_gui()
+            self.sync_preset(current_preset_name)
+
+    def sync_preset(self, preset_name: str):
+        # preset texts can be long, only read them back if they were edited.
+        if preset_name not in self.chatgpt_client.presets or self.preset_fields_modified():
+            self.chatgpt_client.presets[preset_name] = self._get_current_preset_from_gui()
+            for name in PRESET_FIELDS:
+                self.preset_field(name).document().setModified(False)
+
+    def preset_field(self, name: str) -> QTextEdit:
+        return getattr(self, name)
+
+    def preset_fields_modified(self) -> bool:
+        return any(self.preset_field(name).document().isModified() for name in PRESET_FIELDS)
 
     def save_settings_to_disk(self):
+        self.save_timer.stop()
         self.sync_settings_with_backend()
+        # both only write if something changed, and keep what other programs changed meanwhile in other keys.
         self.chatgpt_client.save_global_settings_to_disk()
         self.chatgpt_client.save_presets_to_disk()
+        self.reload_configs()
 
-    def format_message(self, message: str, role: str):
-        html_role = f"START{role}:"
-        message = f"{html_role} {message}"
-        if self.chatgpt_client.globals.md2html:
-            message = str(markdown2.markdown(message, safe_mode=False))
-        else:
-            message = message.replace("<", "&lt;").replace(">", "&gt;").replace("\n", "<br>")
-        message = message.replace("&quot;", '"')
-
-        message = highlight_quoted_text(message, color="gray")
-        message = wrap_code_blocks(message)
+    def reload_configs(self):
+        """
+        Show edits that other programs made to the config files.
+        Unsaved edits take precedence for the settings and presets they touch.
+        """
+        if self.save_timer.isActive() and self.chatgpt_client.configs_changed_on_disk():
+            # saving merges the other program's edits, and reloads them into the fields afterwards.
+            return self.save_settings_to_disk()
+        changed_settings, changed_presets = self.chatgpt_client.reload_changed_configs()
+        if changed_settings:
+            self.load_settings_fields(changed_settings)
+        if changed_presets:
+            preset_name = self.preset_dropdown.currentText()
+            self.preset_dropdown.blockSignals(True)
+            self.preset_dropdown.clear()
+            self.preset_dropdown.addItems(self.chatgpt_client.presets)
+            self.preset_dropdown.setCurrentText(preset_name)
+            self.preset_dropdown.blockSignals(False)
+            if preset_name in changed_presets and not self.preset_fields_modified():
+                self.load_preset_fields(self.chatgpt_client.presets.get(preset_name, Preset()))
+
+    def load_settings_fields(self, changed_settings: set[str]):
+        settings = self.chatgpt_client.globals
+        widgets = [
+            self.api_dropdown,
+            self.g4f_providers_field,
+            self.g4f_race_checkbox,
+            self.base_url_field,
+            self.api_key_field,
+            self.user_name_field,
+            self.theme_dropdown,
+            self.format_md_checkbox,
+            self.resume_truncated_checkbox,
+            self.warmup_checkbox,
+            self.swipes_spinbox,
+            self.prefetch_swipe_checkbox,
+            self.max_tokens_spinbox,
+            self.temperature_spinbox,
+        ]
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.api_dropdown.setCurrentText(settings.api_type)
+        self.g4f_providers_field.setText(", ".join(settings.g4f_providers))
+        self.g4f_race_checkbox.setChecked(settings.g4f_race)
+        self.base_url_field.setText(settings.base_url)
+        self.api_key_field.setText(settings.api_key)
+        self.user_name_field.setText(settings.user_name)
+        self.theme_dropdown.setCurrentText(settings.theme)
+        self.format_md_checkbox.setChecked(settings.md2html)
+        self.resume_truncated_checkbox.setChecked(settings.resume_truncated)
+        self.warmup_checkbox.setChecked(settings.warmup)
+        self.swipes_spinbox.setValue(settings.swipes)
+        self.prefetch_swipe_checkbox.setChecked(settings.prefetch_swipe)
+        self.max_tokens_spinbox.setValue(settings.max_tokens)
+        self.temperature_spinbox.setValue(settings.temperature)
+        for widget in widgets:
+            widget.blockSignals(False)
+        if "theme" in changed_settings:
+            self.switch_theme(settings.theme)
+        if changed_settings & {"api_type", "base_url", "model_names", "selected_model"}:
+            self.model_dropdown.blockSignals(True)
+            self.populate_model_dropdown(self.current_tab.chatgpt_client.globals.selected_model)
+            self.model_dropdown.blockSignals(False)
 
-        message = message.replace(
-            html_role,
-            f'<div style="font-size: 20px; border-bottom: 1px solid gray;"><b>{datetime.datetime.now().strftime("%H:%M")}</b>: {role}</div>',
-            1,
+    def format_message(self, message: str, role: str):
+        misses = render_message.cache_info().misses if self.profiler.enabled else 0
+        body = render_message(
+            message,
+            self.chatgpt_client.globals.md2html,
+            self.chatgpt_client.globals.theme,
+            self.font_size,
+            self.profiler.stage,
         )
-        return message
-
-    def clear_history(self):
-        self.messages_text.clear()
-        self.chatgpt_client.chat_history.clear()
+        if self.profiler.enabled and render_message.cache_info().misses == misses:
+            # misses are timed step by step inside render_body.
+            self.profiler.count("render_cache_hit")
+        with self.profiler.stage("role_header"):
+            header = render_header(role)
+        return header + body
 
     def apply_preset(self, preset_name: str):
         if preset_name in self.chatgpt_client.presets:
-            if self.chatgpt_client.chat_history:
+            tab = self.current_tab
+            if tab.chatgpt_client.chat_history:
                 reply = QMessageBox.question(
                     self,
                     "New Conversation",
@@ -540,28 +1074,38 @@ class ChatGUI(QWidget):
                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                     QMessageBox.StandardButton.No,
                 )
-                if reply == QMessageBox.StandardButton.Yes:
-                    self.clear_history()
-                else:
+                if reply != QMessageBox.StandardButton.Yes:
+                    self.preset_dropdown.blockSignals(True)
+                    self.preset_dropdown.setCurrentText(tab.preset_name)
+                    self.preset_dropdown.blockSignals(False)
                     return
-            else:
-                self.clear_history()
+            if tab.preset_name in self.chatgpt_client.presets:
+                self.sync_preset(tab.preset_name)
+            tab.stop()
+            tab.clear_history()
+            tab.preset_name = preset_name
+            self.update_tab_title(tab)
 
             preset = self.chatgpt_client.presets[preset_name]
-            self.system_prompt1.setText(preset.system_prompt1)
-            self.system_prompt2.setText(preset.system_prompt2)
-            self.system_prompt3.setText(preset.system_prompt3)
-            self.character_description.setPlainText(preset.character_description)
-            self.first_ai_message.setText(preset.first_ai_message)
-            self.example_chat.setPlainText(preset.example_chat)
-            self.world_lore.setPlainText(preset.world_lore)
-
-            if preset.first_ai_message:
-                self.messages_text.append(self.format_message(preset.first_ai_message, preset_name))
-                self.user_message.setDisabled(True)
-                self.user_message.clear()
-                self.user_message.setDisabled(False)
-                self.user_message.setFocus()
+            self.load_preset_fields(preset)
+
+            if greeting := tab.chatgpt_client.greeting(preset_name):
+                tab.post_message(greeting.content, preset_name)
+                tab.user_message.setDisabled(True)
+                tab.user_message.clear()
+                tab.user_message.setDisabled(False)
+                tab.user_message.setFocus()
+
+    def load_preset_fields(self, preset: Preset):
+        self.system_prompt1.setText(preset.system_prompt1)
+        self.system_prompt2.setText(preset.system_prompt2)
+        self.system_prompt3.setText(preset.system_prompt3)
+        self.character_description.setPlainText(preset.character_description)
+        self.first_ai_message.setText(preset.first_ai_message)
+        self.example_chat.setPlainText(preset.example_chat)
+        self.world_lore.setPlainText(preset.world_lore)
+        for name in PRESET_FIELDS:
+            self.preset_field(name).document().setModified(False)
 
     def _get_current_preset_from_gui(self) -> Preset:
         return Preset(
@@ -599,46 +1143,27 @@ class ChatGUI(QWidget):
                 print(ex)
         self.model_dropdown.setCurrentText(selected_model)
 
-    def send_message(self) -> None:
-        user_message = self.user_message.toPlainText()
-        if not user_message:
-            return
-
-        self.sync_settings_with_backend()
-
-        self.update_ui(user_message, is_user=True)
-
-        if self.worker and self.worker.isRunning():
-            self.worker.wait()
-
-        self.worker = Worker(self.chatgpt_client, user_message, self.preset_dropdown.currentText())
-        self.worker.finished.connect(self.update_ui)
-        self.worker.start()
-
-    def update_ui(self, message: str, is_user: bool = False):
-        role = "User" if is_user else self.preset_dropdown.currentText()
-        self.messages_text.append(self.format_message(message, role))
-        if is_user:
-            self.user_message.clear()
-            self.user_message.setDisabled(True)
-            self.send_button.setDisabled(True)
-        else:
-            self.user_message.clear()
-            self.user_message.setDisabled(False)
-            self.send_button.setDisabled(False)
-            self.user_message.setFocus()
-
     def closeEvent(self, event):
-        if self.worker and self.worker.isRunning():
-            self.worker.terminate()
-            self.worker.wait()
+        if self.save_timer.isActive():
+            self.save_settings_to_disk()
+        for index in range(self.tabs.count()):
+            self.tabs.widget(index).stop()
+        for worker in self.stopped_workers:
+            # a request that is still waiting for the response headers only notices the cancel afterwards.
+            if not worker.wait(WORKER_EXIT_TIMEOUT_MS):
+                worker.terminate()
+                worker.wait()
+        self.chatgpt_client.warmer.stop()
+        if dump_path := self.profiler.dump():
+            print(self.profiler.summary())
+            print(f"Profile written to {dump_path}.prof and {dump_path}.txt")
         event.accept()
 
 
-def show_window(chatgpt_client: ChatGPTClient | None = None):
+def show_window(chatgpt_client: ChatGPTClient | None = None, profile_dir: pathlib.Path | None = None):
     app = QApplication(sys.argv)
     app.setStyleSheet(warm_theme_style)  # DEFAULT THEME
-    chat_gui = ChatGUI(chatgpt_client or ChatGPTClient(), app)
+    chat_gui = ChatGUI(chatgpt_client or ChatGPTClient(), app, RenderProfiler(profile_dir))
     chat_gui.setWindowTitle(PROGRAM_NAME)
     chat_gui.setGeometry(100, 100, 400, 600)
     chat_gui.show()
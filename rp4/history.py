@@ -0,0 +1,125 @@
+import collections.abc
+import typing
+from functools import lru_cache
+
+from rp4.payload import encode_json
+
+SHARED_MESSAGES_CACHE_SIZE = 256
+
+
+class ChatHistoryEntry(typing.TypedDict):
+    role: str
+    content: str
+
+
+class Message:
+    """
+    An immutable chat message. Its JSON encoding is computed once and then shared
+    by every history and request body that contains the message.
+    """
+
+    __slots__ = ("role", "content", "_encoded")
+
+    def __init__(self, role: str, content: str):
+        object.__setattr__(self, "role", role)
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "_encoded", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __getitem__(self, key: str) -> str:
+        # reads like the {"role": ..., "content": ...} dicts it replaces.
+        if key in ("role", "content"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return self is other or (self.role == other.role and self.content == other.content)
+
+    def __hash__(self) -> int:
+        return hash((self.role, self.content))
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def as_dict(self) -> ChatHistoryEntry:
+        return {"role": self.role, "content": self.content}
+
+    @property
+    def encoded(self) -> bytes:
+        if self._encoded is None:
+            object.__setattr__(self, "_encoded", encode_json(self.as_dict()))
+        return self._encoded
+
+
+@lru_cache(SHARED_MESSAGES_CACHE_SIZE)
+def shared_message(role: str, content: str, header: str = "") -> Message:
+    """
+    One Message per distinct preset block, referenced by every conversation that uses the preset.
+    """
+    return Message(role, header + content)
+
+
+class ChatHistory(collections.abc.MutableSequence):
+    """
+    The messages of a conversation. snapshot() is O(1): the snapshot shares the list of messages
+    until either side is changed, which then copies the list (the references, never the messages).
+    """
+
+    __slots__ = ("_messages", "_shared")
+
+    def __init__(self, messages: typing.Iterable[Message] = ()):
+        self._messages: list[Message] = list(messages)
+        self._shared = False
+
+    def _own(self):
+        if self._shared:
+            self._messages = list(self._messages)
+            self._shared = False
+
+    def snapshot(self) -> "ChatHistory":
+        """
+        A copy for requests running in other threads, unaffected by later changes of this history.
+        """
+        snapshot = ChatHistory()
+        snapshot._messages = self._messages
+        snapshot._shared = self._shared = True
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __iter__(self) -> typing.Iterator[Message]:
+        return iter(self._messages)
+
+    def __setitem__(self, index, message):
+        self._own()
+        self._messages[index] = message
+
+    def __delitem__(self, index):
+        self._own()
+        del self._messages[index]
+
+    def insert(self, index: int, message: Message):
+        self._own()
+        self._messages.insert(index, message)
+
+    def append(self, message: Message):
+        self._own()
+        self._messages.append(message)
+
+    def clear(self):
+        self._messages = []
+        self._shared = False
+
+    def __repr__(self) -> str:
+        return f"ChatHistory({self._messages!r})"
@@ -0,0 +1,65 @@
+import gzip
+import json
+import threading
+import typing
+
+GZIP_MIN_BYTES = 64 * 1024
+
+
+def encode_json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class MessagesEncoder:
+    """
+    Keeps the JSON encoding of each message of a chat history between turns.
+    While the history starts with the cached messages, only the messages appended since the last call are encoded.
+    If the history was cleared or its tail was replaced, the cache is rolled back to the common prefix.
+    Messages that carry their own encoding (rp4.history.Message) are not encoded at all, and the
+    cache only references their bytes, so large preset blocks are not copied into every conversation.
+    The body is joined from the cached pieces in a single copy, the only per-turn cost that grows with the history.
+    """
+
+    def __init__(self):
+        self._messages: list[typing.Mapping] = []
+        self._pieces: list[bytes] = []  # the encoded messages with the separators between them
+        self._lock = threading.Lock()
+
+    def _common_prefix_len(self, messages: typing.Sequence[typing.Mapping]) -> int:
+        cached = len(self._messages)
+        # the usual case, checked in C: list comparison takes identical items as equal without comparing them.
+        if len(messages) >= cached and self._messages == list(messages[:cached]):
+            return cached
+        for idx, (cached_message, message) in enumerate(zip(self._messages, messages)):
+            if cached_message is not message:
+                return idx
+        return min(cached, len(messages))
+
+    def _update(self, messages: typing.Sequence[typing.Mapping]):
+        del self._messages[self._common_prefix_len(messages) :]
+        del self._pieces[max(0, 2 * len(self._messages) - 1) :]
+        for message in messages[len(self._messages) :]:
+            encoded = getattr(message, "encoded", None)
+            if self._pieces:
+                self._pieces.append(b",")
+            self._pieces.append(encoded if isinstance(encoded, bytes) else encode_json(message))
+            self._messages.append(message)
+
+    def encode_body(self, fields: dict, messages: typing.Sequence[typing.Mapping]) -> bytes:
+        """
+        Build a request body with the given fields and a "messages" array.
+        """
+        head = encode_json(fields)
+        with self._lock:
+            self._update(messages)
+            return b"".join((head[:-1], (b',"messages":[' if fields else b'"messages":['), *self._pieces, b"]}"))
+
+
+def maybe_compress(body: bytes, headers: dict, min_bytes: int = GZIP_MIN_BYTES) -> bytes:
+    """
+    Gzip the body and set Content-Encoding if it is large enough to be worth it.
+    """
+    if len(body) < min_bytes:
+        return body
+    headers["Content-Encoding"] = "gzip"
+    return gzip.compress(body, compresslevel=5)
@@ -0,0 +1,99 @@
+import collections
+import contextlib
+import cProfile
+import dataclasses
+import datetime
+import pathlib
+import pstats
+import time
+
+STALL_CHECK_INTERVAL_MS = 50
+STALL_THRESHOLD_MS = 100
+
+
+@dataclasses.dataclass
+class StageTimings:
+    calls: int = 0
+    total_sec: float = 0.0
+    max_sec: float = 0.0
+
+    def add(self, elapsed_sec: float):
+        self.calls += 1
+        self.total_sec += elapsed_sec
+        self.max_sec = max(self.max_sec, elapsed_sec)
+
+
+class RenderProfiler:
+    """
+    Collects timings of GUI render stages and event loop stalls.
+    When disabled, every method is a cheap no-op.
+    """
+
+    def __init__(self, output_dir: pathlib.Path | None = None):
+        self.enabled = output_dir is not None
+        self.output_dir = output_dir
+        self.stages: dict[str, StageTimings] = collections.defaultdict(StageTimings)
+        self.stalls = StageTimings()
+        self._last_heartbeat: float | None = None
+        self._profile = cProfile.Profile() if self.enabled else None
+
+    def start(self):
+        if self.enabled:
+            self._profile.enable()
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name].add(time.perf_counter() - start)
+
+    def stage(self, name: str):
+        return self._timed(name) if self.enabled else contextlib.nullcontext()
+
+    def count(self, name: str):
+        """
+        Count an event that takes no time worth measuring, like a cache hit.
+        """
+        if self.enabled:
+            self.stages[name].calls += 1
+
+    def heartbeat(self):
+        """
+        Called by a timer every STALL_CHECK_INTERVAL_MS. A late call means the event loop was blocked.
+        """
+        now = time.perf_counter()
+        if self._last_heartbeat is not None:
+            lateness_sec = (now - self._last_heartbeat) - STALL_CHECK_INTERVAL_MS / 1000
+            if lateness_sec * 1000 > STALL_THRESHOLD_MS:
+                self.stalls.add(lateness_sec)
+        self._last_heartbeat = now
+
+    def summary(self) -> str:
+        lines = [f"{'stage':<24} {'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+        for name, timings in sorted(self.stages.items(), key=lambda item: -item[1].total_sec):
+            lines.append(
+                f"{name:<24} {timings.calls:>7} {timings.total_sec * 1e3:>10.1f} "
+                f"{timings.total_sec * 1e3 / timings.calls:>9.2f} {timings.max_sec * 1e3:>9.1f}"
+            )
+        lines.append(
+            f"event loop stalls over {STALL_THRESHOLD_MS} ms: {self.stalls.calls}, "
+            f"longest {self.stalls.max_sec * 1e3:.1f} ms"
+        )
+        return "\n".join(lines)
+
+    def dump(self) -> pathlib.Path | None:
+        """
+        Write a text summary and a cProfile dump (readable by pstats, snakeviz, flameprof, etc.)
+        """
+        if not self.enabled:
+            return None
+        self._profile.disable()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.output_dir / datetime.datetime.now().strftime("rp4-%Y%m%d-%H%M%S")
+        self._profile.dump_stats(stem.with_suffix(".prof"))
+        with open(stem.with_suffix(".txt"), "w", encoding="utf-8") as of:
+            of.write(self.summary() + "\n\n")
+            pstats.Stats(self._profile, stream=of).sort_stats("cumulative").print_stats(40)
+        return stem
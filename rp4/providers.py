@@ -0,0 +1,188 @@
+import dataclasses
+import json
+import pathlib
+import queue
+import threading
+import time
+import typing
+
+import g4f
+
+from rp4.config import atomic_write_json
+
+_DONE = object()
+
+
+class ProviderError(RuntimeError):
+    pass
+
+
+@dataclasses.dataclass
+class ProviderStats:
+    attempts: int = 0
+    successes: int = 0
+    ttft_total_sec: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        # providers that were never tried rank first, so that they get a chance.
+        return self.successes / self.attempts if self.attempts else 1.0
+
+    @property
+    def mean_ttft_sec(self) -> float:
+        return self.ttft_total_sec / self.successes if self.successes else 0.0
+
+
+class ProviderScoreboard:
+    """
+    Per-provider success rate and time to first token, persisted between runs.
+    """
+
+    def __init__(self, file_path: pathlib.Path):
+        self.file_path = file_path
+        self.stats: dict[str, ProviderStats] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, encoding="utf-8") as f:
+                self.stats = {name: ProviderStats(**data) for name, data in json.load(f).items()}
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            self.stats = {}
+
+    def save(self):
+        with self._lock:
+            payload = {name: dataclasses.asdict(stats) for name, stats in self.stats.items()}
+        atomic_write_json(self.file_path, payload)
+
+    def record(self, provider_name: str, ttft_sec: float | None):
+        """
+        Record an attempt. ttft_sec is None if the provider failed before producing a token.
+        """
+        with self._lock:
+            stats = self.stats.setdefault(provider_name, ProviderStats())
+            stats.attempts += 1
+            if ttft_sec is not None:
+                stats.successes += 1
+                stats.ttft_total_sec += ttft_sec
+
+    def rank(self, provider_names: list[str]) -> list[str]:
+        with self._lock:
+            return sorted(
+                provider_names,
+                key=lambda name: (
+                    -self.stats.get(name, ProviderStats()).success_rate,
+                    self.stats.get(name, ProviderStats()).mean_ttft_sec,
+                ),
+            )
+
+
+def race_providers(
+    provider_names: list[str],
+    model: str,
+    messages: list[dict],
+    scoreboard: ProviderScoreboard,
+    on_chunk: typing.Callable[[str], None] | None = None,
+) -> str:
+    """
+    Stream the same request from several providers at once.
+    The first provider to produce a token wins, the others close their streams as soon as they receive anything.
+    The scoreboard is saved once every provider has recorded its result.
+    """
+    events = queue.Queue()
+    winner = None
+    winner_lock = threading.Lock()
+    finished = threading.Event()  # the race is over, even the winner stops if nobody reads its chunks
+    remaining = len(provider_names)
+
+    def run(provider_name: str):
+        nonlocal winner, remaining
+        start = time.perf_counter()
+        got_token = False
+        stream = None
+        try:
+            stream = g4f.ChatCompletion.create(model=model, messages=messages, provider=provider_name, stream=True)
+            for chunk in stream:
+                # checked before skipping anything, losers may only receive progress or usage items for a while.
+                if finished.is_set() or winner not in (None, provider_name):
+                    if not got_token and isinstance(chunk, str) and chunk:
+                        got_token = True
+                        scoreboard.record(provider_name, time.perf_counter() - start)
+                    return
+                if not isinstance(chunk, str) or not chunk:
+                    continue
+                if not got_token:
+                    got_token = True
+                    scoreboard.record(provider_name, time.perf_counter() - start)
+                    with winner_lock:
+                        winner = winner or provider_name
+                    if winner != provider_name:
+                        return
+                events.put((provider_name, chunk))
+        except Exception as ex:
+            if not got_token:
+                scoreboard.record(provider_name, None)
+            events.put((provider_name, ex))
+        else:
+            if not got_token:
+                scoreboard.record(provider_name, None)
+                events.put((provider_name, ProviderError(f"{provider_name} returned an empty response")))
+            else:
+                events.put((provider_name, _DONE))
+        finally:
+            # releases the provider's connection now instead of whenever the generator is collected.
+            if close := getattr(stream, "close", None):
+                try:
+                    close()
+                except Exception:
+                    pass
+            with winner_lock:
+                remaining -= 1
+                last = remaining == 0
+            if last:
+                scoreboard.save()
+
+    for provider_name in provider_names:
+        threading.Thread(target=run, args=(provider_name,), daemon=True).start()
+
+    text = ""
+    failed = []
+    try:
+        while True:
+            provider_name, item = events.get()
+            if winner is not None and provider_name != winner:
+                continue
+            if item is _DONE:
+                return text
+            if isinstance(item, Exception):
+                if provider_name == winner:
+                    if text:
+                        return text
+                    raise item
+                failed.append(provider_name)
+                if len(failed) == len(provider_names):
+                    raise ProviderError(f"All providers failed: {', '.join(failed)}") from item
+                continue
+            text += item
+            if on_chunk:
+                on_chunk(item)
+    finally:
+        finished.set()
+
+
+def stream_g4f(
+    model: str,
+    messages: list[dict],
+    on_chunk: typing.Callable[[str], None] | None = None,
+) -> str:
+    """
+    Stream a reply from the provider g4f picks by itself.
+    """
+    text = ""
+    for chunk in g4f.ChatCompletion.create(model=model, messages=messages, stream=True):
+        if isinstance(chunk, str) and chunk:
+            text += chunk
+            if on_chunk:
+                on_chunk(chunk)
+    return text
@@ -0,0 +1,100 @@
+import contextlib
+import datetime
+import functools
+import html
+import re
+import typing
+
+import markdown2
+
+QUOTE_COLOR = "gray"
+RENDER_CACHE_SIZE = 1024
+
+Stage = typing.Callable[[str], typing.ContextManager]
+
+
+def _untimed(name: str) -> typing.ContextManager:
+    return contextlib.nullcontext()
+
+
+# a private use character marks code blocks while markdown2 runs.
+_CODE = "\ue002"
+_PRIVATE_USE = re.compile("[\ue000-\ue002]")
+_TOKENS = re.compile(
+    # fenced code block, possibly still unterminated while a reply is streaming.
+    r"(?P<fence>```(?:[\w+#.-]*\n)?(?P<code>.*?)(?:```|\Z))"
+    # inline code span, left to markdown2.
+    r"|(?P<span>`[^`\n]+`)",
+    re.DOTALL,
+)
+# a highlighted quote never spans these: paragraphs, list items, table cells or blank lines.
+_BLOCK_TAGS = r"/?(?:p|div|li|ul|ol|h[1-6]|blockquote|pre|table|thead|tbody|tr|td|th|hr)\b|br>\s*<br"
+_HTML = re.compile(
+    # a code block set aside by the tokenizer, markdown2 wraps it in a paragraph of its own.
+    f"(?:<p>)?{_CODE}(?P<block>\\d+){_CODE}(?:</p>)?"
+    # code spans and tags, including the attributes where link titles and inline HTML keep their quotes.
+    r"|(?P<skip><code>[^<]*</code>|`[^`<\n]+`|<[^>]*>)"
+    # quoted speech in the text, which may contain inline markup but not a code block.
+    rf'|"(?P<quote>(?:[^"<{_CODE}]|<code>[^<]*</code>|<(?!code>|{_BLOCK_TAGS})[^>]*>)*)"'
+)
+
+
+def render_body(message: str, md2html: bool, stage: Stage = _untimed) -> str:
+    """
+    Render a message to HTML.
+    Code blocks are escaped and set aside, markdown2 (or plain escaping) runs once,
+    and a single pass over its output puts the code blocks back and highlights quotes in the text.
+    stage(name) is entered around each of these steps, e.g. RenderProfiler.stage.
+    """
+    with stage("render_tokenize"):
+        message = _PRIVATE_USE.sub("", message)
+        code_blocks = []
+        parts = []
+        pos = 0
+        for match in _TOKENS.finditer(message):
+            parts.append(message[pos : match.start()])
+            if match["fence"] is not None:
+                parts.append(
+                    f"\n\n{_CODE}{len(code_blocks)}{_CODE}\n\n" if md2html else f"{_CODE}{len(code_blocks)}{_CODE}"
+                )
+                code_blocks.append(f"<pre>{html.escape(match['code'], quote=False)}</pre>")
+            else:
+                parts.append(match["span"])
+            pos = match.end()
+        parts.append(message[pos:])
+        text = "".join(parts)
+
+    if md2html:
+        with stage("render_markdown2"):
+            text = str(markdown2.markdown(text, safe_mode=False))
+    else:
+        with stage("render_escape"):
+            text = html.escape(text, quote=False).replace("\n", "<br>")
+
+    def replace(match: re.Match) -> str:
+        if match["block"] is not None:
+            return code_blocks[int(match["block"])]
+        if match["skip"] is not None:
+            return match["skip"]
+        return f'"<span style="color: {QUOTE_COLOR};">{match["quote"]}</span>"'
+
+    with stage("render_substitute"):
+        return _HTML.sub(replace, text)
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_message(message: str, md2html: bool, theme: str, font_size: int, stage: Stage = _untimed) -> str:
+    """
+    Cached render_body. Every display setting is part of the key,
+    so re-rendering old messages after a theme or font change never returns stale HTML.
+    stage is only used on cache misses, it is the same for every call of a window and so does not split the cache.
+    """
+    return render_body(message, md2html, stage)
+
+
+def render_header(role: str, timestamp: datetime.datetime | None = None) -> str:
+    timestamp = timestamp or datetime.datetime.now()
+    return (
+        '<div style="font-size: 20px; border-bottom: 1px solid gray;">'
+        f'<b>{timestamp.strftime("%H:%M")}</b>: {html.escape(role)}</div>'
+    )
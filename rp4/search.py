@@ -0,0 +1,143 @@
+import dataclasses
+import datetime
+import pathlib
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation TEXT NOT NULL,
+    role TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    created REAL NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class SearchHit:
+    message_id: int
+    conversation: str
+    role: str
+    preset: str
+    model: str
+    created: datetime.datetime
+    snippet: str
+
+
+def to_match_expression(query: str) -> str:
+    """
+    Turn free text into an FTS5 query: all words must match, the last one as a prefix (search as you type).
+    Words are quoted, so punctuation in the query is never parsed as FTS5 syntax.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class TranscriptIndex:
+    """
+    Full-text index over all finalized messages, stored in SQLite FTS5 next to the config files.
+    """
+
+    def __init__(self, file_path: pathlib.Path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # opened on first use, most runs never search or index anything.
+        if self._db is None:
+            self._db = sqlite3.connect(self.file_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def add(self, conversation: str, role: str, content: str, preset: str, model: str) -> int:
+        with self._lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO messages (conversation, role, preset, model, created, content) VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation, role, preset, model, time.time(), content),
+            )
+            self.db.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+            return cursor.lastrowid
+
+    def replace(self, message_id: int, content: str):
+        """
+        Swap the content of an indexed message, e.g. when another alternative reply is selected.
+        """
+        with self._lock, self.db:
+            if row := self.db.execute("SELECT content FROM messages WHERE id = ?", (message_id,)).fetchone():
+                self.db.execute(
+                    "INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', ?, ?)",
+                    (message_id, row[0]),
+                )
+                self.db.execute("UPDATE messages SET content = ? WHERE id = ?", (content, message_id))
+                self.db.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (message_id, content))
+
+    def search(
+        self,
+        query: str,
+        preset: str | None = None,
+        model: str | None = None,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+        limit: int = 20,
+        highlight: tuple[str, str] = ("[", "]"),
+    ) -> list[SearchHit]:
+        if not (match := to_match_expression(query)):
+            return []
+        conditions, params = ["messages_fts MATCH ?"], [*highlight, match]
+        for condition, value in (
+            ("m.preset = ?", preset),
+            ("m.model = ?", model),
+            ("m.created >= ?", since and since.timestamp()),
+            ("m.created < ?", until and until.timestamp()),
+        ):
+            if value:
+                conditions.append(condition)
+                params.append(value)
+        sql = f"""
+            SELECT m.id, m.conversation, m.role, m.preset, m.model, m.created,
+                   snippet(messages_fts, 0, ?, ?, '…', 16)
+            FROM messages_fts JOIN messages AS m ON m.id = messages_fts.rowid
+            WHERE {" AND ".join(conditions)}
+            ORDER BY rank
+            LIMIT ?
+        """
+        with self._lock:
+            rows = self.db.execute(sql, (*params, limit)).fetchall()
+        return [
+            SearchHit(row[0], row[1], row[2], row[3], row[4], datetime.datetime.fromtimestamp(row[5]), row[6])
+            for row in rows
+        ]
+
+    def conversation(self, conversation: str) -> list[tuple[int, str, str]]:
+        """
+        All indexed messages of a conversation as (message_id, role, content), oldest first.
+        """
+        with self._lock:
+            return self.db.execute(
+                "SELECT id, role, content FROM messages WHERE conversation = ? ORDER BY id",
+                (conversation,),
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
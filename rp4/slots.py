@@ -0,0 +1,40 @@
+import contextlib
+import threading
+
+
+class RequestSlots:
+    """
+    Limits the requests in flight over the shared connection pool.
+    Background requests (alternative replies, prefetches) leave one slot to the foreground and let waiting
+    foreground requests go first, so they never delay the reply the user is waiting for.
+    With a single slot there is nothing to reserve, a background request that has it runs to its end.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.used = 0
+        self.foreground_waiting = 0
+        self._condition = threading.Condition()
+
+    def _available(self, background: bool) -> bool:
+        if background:
+            return self.used < max(1, self.size - 1) and not self.foreground_waiting
+        return self.used < self.size
+
+    @contextlib.contextmanager
+    def acquire(self, background: bool = False):
+        with self._condition:
+            if not background:
+                self.foreground_waiting += 1
+            try:
+                self._condition.wait_for(lambda: self._available(background))
+            finally:
+                if not background:
+                    self.foreground_waiting -= 1
+            self.used += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= 1
+                self._condition.notify_all()
@@ -0,0 +1,70 @@
+import collections
+import concurrent.futures
+import threading
+import typing
+
+
+def run_in_background(function: typing.Callable[..., str], *args) -> concurrent.futures.Future:
+    # a daemon thread, so that an unfinished prefetch never keeps the program from exiting.
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class Swipes:
+    """
+    Alternative replies to the latest turn. Only the selected one is part of the chat history,
+    the others are kept for switching back, and more can be fetched in the background.
+    """
+
+    def __init__(self):
+        self.alternatives: list[str] = []
+        self.selected = 0
+        self.message_id: int | None = None  # transcript row of the reply
+        self.pending: collections.deque[concurrent.futures.Future] = collections.deque()
+
+    @property
+    def current(self) -> str:
+        return self.alternatives[self.selected]
+
+    def reset(self):
+        # replies for an older context are useless, requests that have already started just run out.
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.alternatives = []
+        self.selected = 0
+        self.message_id = None
+
+    def add(self, text: str):
+        self.alternatives.append(text)
+        self.selected = len(self.alternatives) - 1
+
+    def select(self, index: int):
+        self.selected = max(0, min(index, len(self.alternatives) - 1))
+
+    def fetch(self, function: typing.Callable[..., str], *args):
+        self.pending.append(run_in_background(function, *args))
+
+    def take_pending(self) -> str | None:
+        """
+        The oldest alternative fetched in the background, waiting for it if it is still on its way.
+        None if nothing was fetched or all fetches failed.
+        """
+        while self.pending:
+            future = self.pending.popleft()
+            try:
+                if text := future.result():
+                    return text
+            except Exception:
+                continue
+        return None
@@ -0,0 +1,115 @@
+import datetime
+import random
+import re
+import typing
+from functools import lru_cache
+
+TEMPLATE_CACHE_SIZE = 256
+# {{name}} or {{name:args}}, and the <USER>/<BOT> placeholders of older character cards.
+_MACRO = re.compile(r"\{\{\s*(\w+)\s*(?::(.*?))?\}\}|<((?-i:USER|BOT|CHAR))>", re.DOTALL | re.IGNORECASE)
+
+
+class MacroContext(typing.NamedTuple):
+    char: str
+    user: str
+
+
+def _random_choice(args: str) -> typing.Callable[[MacroContext], str]:
+    # both {{random:a,b,c}} and {{random::a::b::c}} are in use.
+    choices = args[1:].split("::") if args.startswith(":") else args.split(",")
+    return lambda context: random.choice(choices)
+
+
+# macros whose value only depends on the context, they are rendered once per context.
+_STATIC_MACROS = {
+    "char": lambda context: context.char,
+    "bot": lambda context: context.char,
+    "user": lambda context: context.user,
+    "newline": lambda context: "\n",
+}
+
+
+def _long_date(context: MacroContext) -> str:
+    today = datetime.date.today()
+    return f"{today:%B} {today.day}, {today.year}"
+
+
+_STATIC_FUNCTIONS = frozenset(_STATIC_MACROS.values())
+_DYNAMIC_MACROS = {
+    "time": lambda context: f"{datetime.datetime.now():%I:%M %p}".lstrip("0"),
+    "date": _long_date,
+    "weekday": lambda context: f"{datetime.datetime.now():%A}",
+    "isotime": lambda context: f"{datetime.datetime.now():%H:%M}",
+    "isodate": lambda context: f"{datetime.date.today():%Y-%m-%d}",
+}
+
+
+class Template:
+    """
+    A preset field split into literal text and the macros between it.
+    Macros that only depend on the context are filled in once per context, so a card without
+    random or time macros renders to a cached string, and the others only join their precomputed pieces.
+    """
+
+    __slots__ = ("source", "texts", "macros", "is_static", "_resolved")
+
+    def __init__(self, source: str, texts: list[str], macros: list[typing.Callable[[MacroContext], str]]):
+        self.source = source
+        self.texts = texts  # one more than macros, macros[i] goes between texts[i] and texts[i + 1]
+        self.macros = macros
+        self.is_static = all(macro in _STATIC_FUNCTIONS for macro in macros)
+        self._resolved: dict[MacroContext, tuple[list[str], list[typing.Callable[[MacroContext], str]]]] = {}
+
+    def resolve(self, context: MacroContext) -> tuple[list[str], list[typing.Callable[[MacroContext], str]]]:
+        if (resolved := self._resolved.get(context)) is None:
+            texts, macros, pending = [], [], [self.texts[0]]
+            for macro, text in zip(self.macros, self.texts[1:]):
+                if macro in _STATIC_FUNCTIONS:
+                    pending.append(macro(context))
+                else:
+                    texts.append("".join(pending))
+                    macros.append(macro)
+                    pending = []
+                pending.append(text)
+            texts.append("".join(pending))
+            resolved = self._resolved[context] = texts, macros
+        return resolved
+
+    def render(self, context: MacroContext) -> str:
+        texts, macros = self.resolve(context)
+        if not macros:
+            return texts[0]
+        # each occurrence of a random macro is its own function, repeated time macros agree within a render.
+        values = {macro: macro(context) for macro in set(macros)}
+        pieces = [""] * (2 * len(macros) + 1)
+        pieces[0::2] = texts
+        pieces[1::2] = [values[macro] for macro in macros]
+        return "".join(pieces)
+
+
+@lru_cache(TEMPLATE_CACHE_SIZE)
+def compile_template(source: str) -> Template:
+    """
+    Compile a preset field. Cached by its text, so a field is compiled again only after it was edited.
+    Unknown macros are kept as they are.
+    """
+    texts, macros, position = [], [], 0
+    for match in _MACRO.finditer(source):
+        name, args, placeholder = match[1], match[2], match[3]
+        name = (name or placeholder).lower()
+        if name == "random" and args:
+            macros.append(_random_choice(args))
+        elif name in _STATIC_MACROS and args is None:
+            macros.append(_STATIC_MACROS[name])
+        elif name in _DYNAMIC_MACROS and args is None:
+            macros.append(_DYNAMIC_MACROS[name])
+        else:
+            continue
+        texts.append(source[position : match.start()])
+        position = match.end()
+    texts.append(source[position:])
+    return Template(source, texts, macros)
+
+
+def render_template(source: str, char: str, user: str) -> str:
+    return compile_template(source).render(MacroContext(char, user))
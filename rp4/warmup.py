@@ -0,0 +1,88 @@
+import threading
+import time
+import typing
+
+import requests
+
+if typing.TYPE_CHECKING:
+    from rp4.client import ChatGPTClient
+
+WARMUP_TIMEOUT_SEC = 10
+
+
+class ConnectionWarmer:
+    """
+    Keeps a pooled connection to the API endpoint open, so that the first message
+    after startup or after idling does not pay for DNS, TCP and TLS setup.
+    """
+
+    def __init__(self, client: "ChatGPTClient"):
+        self.client = client
+        self._lock = threading.Lock()
+        self._last_activity = 0.0
+        self._last_warm = 0.0
+        self._in_flight = False
+        self._timer: threading.Timer | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.client.globals.warmup and self.client.globals.api_type == "URL_JSON_API"
+
+    def touch(self):
+        """
+        A real request went through, so the pooled connection is warm.
+        """
+        self._last_warm = time.monotonic()
+
+    def poke(self):
+        """
+        Called on user activity. Warms the connection in the background if it has gone cold.
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._last_activity = now
+        with self._lock:
+            if self._in_flight or now - self._last_warm < self.client.globals.warmup_keepalive_sec:
+                return
+            self._in_flight = True
+        threading.Thread(target=self._warm, daemon=True).start()
+
+    def _warm(self):
+        start = time.perf_counter()
+        try:
+            # any response means the connection is established; HEAD has no body, so it goes back to the pool.
+            self.client.session.head(self.client.globals.base_url, timeout=WARMUP_TIMEOUT_SEC).close()
+        except requests.RequestException as ex:
+            self.client.stats.warmup_failures += 1
+            if self.client.globals.verbose:
+                print(f"Warm-up failed: {ex}")
+        else:
+            self.client.stats.warmups += 1
+            self.client.stats.last_warmup_ms = (time.perf_counter() - start) * 1000
+            self.touch()
+        finally:
+            with self._lock:
+                self._in_flight = False
+            self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        # refresh before the server's idle timeout, but only while the user is around.
+        if not self.enabled or time.monotonic() - self._last_activity > self.client.globals.warmup_idle_sec:
+            return
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.client.globals.warmup_keepalive_sec, self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self):
+        with self._lock:
+            if self._in_flight:
+                return
+            self._in_flight = True
+        self._warm()
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()